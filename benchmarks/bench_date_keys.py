@@ -0,0 +1,66 @@
+"""
+Benchmark of joins and sorts on trade_date as YYYYMMDD strings versus int32 keys,
+shaped like preprocess on the 79-instrument universe:
+for each instrument, merge_all joins 5 frames to a dates header by trade_date, and
+add_pre_price joins pre prices by (trade_date, ticker) for about 10 contracts a day.
+
+python benchmarks/bench_date_keys.py --dates 2500
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+N_INSTRUMENTS = 79
+N_TICKERS = 10
+
+
+def make_instru_data(dates: np.ndarray, rng: np.random.Generator) -> dict[str, pd.DataFrame]:
+    def daily() -> pd.DataFrame:
+        return pd.DataFrame({"trade_date": dates, "x": rng.random(len(dates))})
+
+    contracts = pd.DataFrame({
+        "trade_date": np.repeat(dates, N_TICKERS),
+        "ticker": np.tile([f"T{k:02d}" for k in range(N_TICKERS)], len(dates)),
+        "pre_close": rng.random(len(dates) * N_TICKERS),
+    })
+    return {"maj": daily(), "min": daily(), "vol": daily(), "basis": daily(), "stock": daily(), "contracts": contracts}
+
+
+def run(header: pd.DataFrame, instru_data: dict[str, pd.DataFrame]) -> None:
+    merged = pd.merge(left=header, right=instru_data["maj"], on="trade_date", how="left")
+    for k in ("min", "vol", "basis", "stock"):
+        merged = merged.merge(right=instru_data[k], on="trade_date", how="left", suffixes=("", f"_{k}"))
+    maj = instru_data["maj"].assign(ticker="T00")
+    pd.merge(left=maj, right=instru_data["contracts"], on=["trade_date", "ticker"], how="left")
+    instru_data["contracts"].sort_values(by=["trade_date", "ticker"], ascending=[False, True])
+    instru_data["contracts"].groupby(by="trade_date")["pre_close"].sum()
+
+
+def bench(n_dates: int, repeat: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    keys = pd.bdate_range("2010-01-04", periods=n_dates).strftime("%Y%m%d").astype(int).to_numpy(np.int32)
+    res = {}
+    for label, dates in (("str", keys.astype(str).astype(object)), ("int32", keys)):
+        header = pd.DataFrame({"trade_date": dates})
+        universe_data = [make_instru_data(dates, rng) for _ in range(N_INSTRUMENTS)]
+        elapsed = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for instru_data in universe_data:
+                run(header, instru_data)
+            elapsed.append(time.perf_counter() - t0)
+        res[label] = min(elapsed)
+    summary = pd.DataFrame({"seconds": res})
+    summary["speedup"] = summary.loc["str", "seconds"] / summary["seconds"]
+    return summary
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark joins on string dates versus int32 keys")
+    arg_parser.add_argument("--dates", type=int, default=2500, help="number of trading days of each instrument")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="best of repeat runs is reported")
+    args = arg_parser.parse_args()
+    print(f"{N_INSTRUMENTS} instruments x {args.dates} dates x {N_TICKERS} contracts")
+    print(bench(args.dates, args.repeat))
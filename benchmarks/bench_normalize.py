@@ -0,0 +1,80 @@
+"""
+Benchmark of minute bar normalization, per-row versus vectorized, in rows per second:
+1. timestamps: datetime.strptime(...).timestamp() by map versus solutions.normalize.parse_timestamps;
+2. units: a list of per-row ratios with DataFrame.div versus solutions.normalize.adjust_units.
+
+Data is shaped like one day file, about 555 minutes a day of each contract.
+
+python benchmarks/bench_normalize.py --rows 200000
+"""
+
+import os
+import sys
+import argparse
+import time
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from solutions.normalize import UNIT_COLS, adjust_units, parse_timestamps  # noqa: E402
+
+N_MINUTES = 555
+
+
+def make_data(n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    minutes = pd.date_range("2019-12-30 21:01", periods=N_MINUTES, freq="min").strftime("%Y-%m-%d %H:%M:%S")
+    return pd.DataFrame({
+        "trade_date": np.where(np.arange(n_rows) < n_rows // 2, 20191231, 20200102).astype(np.int32),
+        "timestamp": np.resize(minutes.to_numpy(dtype=object), n_rows),
+        "vol": rng.integers(0, 1000, n_rows).astype(np.float64),
+        "amount": rng.random(n_rows) * 1e6,
+        "oi": rng.integers(0, 100000, n_rows).astype(np.float64),
+    })
+
+
+def timestamps_by_row(data: pd.DataFrame) -> None:
+    data["timestamp"].map(lambda z: dt.datetime.strptime(z, "%Y-%m-%d %H:%M:%S").timestamp()).astype("int64")
+
+
+def timestamps_vectorized(data: pd.DataFrame) -> None:
+    parse_timestamps(data["timestamp"])
+
+
+def units_by_row(data: pd.DataFrame) -> None:
+    adj_ratio = [2 if trade_date < 20200101 else 1 for trade_date in data["trade_date"]]
+    data[UNIT_COLS].div(adj_ratio, axis="index")
+
+
+def units_vectorized(data: pd.DataFrame) -> None:
+    adjust_units(data, "A", cols=UNIT_COLS, trade_dates=data["trade_date"].to_numpy())
+
+
+def bench(n_rows: int, repeat: int) -> pd.DataFrame:
+    data = make_data(n_rows, np.random.default_rng(0))
+    res = {}
+    for label, func in (
+            ("timestamps/row", timestamps_by_row),
+            ("timestamps/vectorized", timestamps_vectorized),
+            ("units/row", units_by_row),
+            ("units/vectorized", units_vectorized),
+    ):
+        elapsed = []
+        for _ in range(repeat):
+            sample = data.copy()
+            t0 = time.perf_counter()
+            func(sample)
+            elapsed.append(time.perf_counter() - t0)
+        res[label] = min(elapsed)
+    summary = pd.DataFrame({"seconds": res})
+    summary["rows/s"] = n_rows / summary["seconds"]
+    return summary
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark per-row versus vectorized minute bar normalization")
+    arg_parser.add_argument("--rows", type=int, default=200_000, help="number of minute bars")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="best of repeat runs is reported")
+    args = arg_parser.parse_args()
+    print(f"{args.rows} rows")
+    print(bench(args.rows, args.repeat).to_string(float_format=lambda z: f"{z:,.3f}"))
@@ -29,94 +29,225 @@ def parse_args():
     arg_parser = argparse.ArgumentParser(description="To calculate data, such as macro and forex")
     arg_parser.add_argument(
         "--switch", type=str,
-        choices=("macro", "forex", "position", "preprocess", "minute_bar"),
+        choices=(
+            "macro", "forex", "position", "preprocess", "minute_bar", "minute_panel",
+            "perf-report", "queue-submit", "queue-work", "serve",
+        ),
         required=True
     )
-    arg_parser.add_argument("--bgn", type=str, help="begin date, format = [YYYYMMDD]", required=True)
+    arg_parser.add_argument("--bgn", type=str,
+                            help="begin date, format = [YYYYMMDD]. "
+                                 "Required unless switch in ('perf-report', 'queue-work', 'serve')")
     arg_parser.add_argument("--stp", type=str, help="stop  date, format = [YYYYMMDD]")
     arg_parser.add_argument("--nomp", default=False, action="store_true",
-                            help="not using multiprocess, for debug. Works only when switch in ('preprocess',)")
+                            help="not using multiprocess, for debug. "
+                                 "Works only when switch in ('preprocess', 'minute_bar', 'queue-work')")
     arg_parser.add_argument("--processes", type=int, default=None, help="number of processes to call")
-    return arg_parser.parse_args()
+    arg_parser.add_argument("--window", type=int, default=10,
+                            help="number of previous runs as baseline. Works only when switch = 'perf-report'")
+    arg_parser.add_argument("--threshold", type=float, default=0.2,
+                            help="flag regression if time per row exceeds baseline by this ratio. "
+                                 "Works only when switch = 'perf-report'")
+    arg_parser.add_argument("--alphas", type=float, nargs="+", default=[],
+                            help="vol_alpha values to sweep besides pro_cfg.vol_alpha, each saved to its own "
+                                 "directory. Works only when switch = 'preprocess'")
+    arg_parser.add_argument("--stages", type=str, nargs="+", default=["preprocess", "minute_bar"],
+                            choices=("preprocess", "minute_bar"),
+                            help="stages to submit. Works only when switch = 'queue-submit'")
+    arg_parser.add_argument("--chunk", type=int, default=250,
+                            help="number of trading days in each work unit. Works only when switch = 'queue-submit'")
+    arg_parser.add_argument("--lease", type=float, default=900,
+                            help="lease of a work unit in seconds. Works only when switch = 'queue-work'")
+    arg_parser.add_argument("--interval", type=float, default=10,
+                            help="seconds between polls. Works only when switch = 'serve'")
+    args = arg_parser.parse_args()
+    if args.switch not in ("perf-report", "queue-work", "serve") and args.bgn is None:
+        arg_parser.error(f"--bgn is required when switch = '{args.switch}'")
+    return args
 
 
 if __name__ == "__main__":
     from project_cfg import pro_cfg, db_struct_cfg
     from husfort.qlog import define_logger
-    from husfort.qcalendar import CCalendar
+    from solutions.calendar_index import CCalendarIndex
 
     define_logger()
 
-    calendar = CCalendar(pro_cfg.calendar_path)
+    calendar = CCalendarIndex(pro_cfg.calendar_path)
     args = parse_args()
-    bgn_date, stp_date = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
-
-    if args.switch == "macro":
-        from solutions.alternative import main_macro
-
-        main_macro(
-            bgn_date=bgn_date,
-            stp_date=stp_date,
-            path_macro_data=pro_cfg.path_macro_data,
-            db_struct_macro=db_struct_cfg.macro,
+    slc_vars = [
+        "pre_settle",
+        "open", "high", "low", "close",
+        "vol", "amount", "oi",
+    ]
+    if args.switch == "perf-report":
+        from solutions.perf import report_perf
+
+        report_perf(ledger_path=pro_cfg.perf_ledger_path, window=args.window, threshold=args.threshold)
+    elif args.switch == "serve":
+        from solutions.serve import CServe
+
+        serve = CServe(
+            universe=pro_cfg.universe,
             calendar=calendar,
-        )
-    elif args.switch == "forex":
-        from solutions.alternative import main_forex
-
-        main_forex(
-            bgn_date=bgn_date,
-            stp_date=stp_date,
+            path_macro_data=pro_cfg.path_macro_data,
             path_forex_data=pro_cfg.path_forex_data,
+            db_struct_macro=db_struct_cfg.macro,
             db_struct_forex=db_struct_cfg.forex,
-            calendar=calendar,
-        )
-    elif args.switch == "position":
-        from solutions.position import main_position_by_instru
-
-        main_position_by_instru(
-            universe=pro_cfg.universe,
-            bgn_date=bgn_date,
-            stp_date=stp_date,
-            calendar=calendar,
-            pos_db_struct=db_struct_cfg.position,
+            db_struct_position=db_struct_cfg.position,
+            db_struct_position_feature=db_struct_cfg.position_feature,
             pos_by_instru_save_dir=pro_cfg.by_instru_pos_dir,
-        )
-    elif args.switch == "preprocess":
-        from solutions.preprocess import main_preprocess
-
-        slc_vars = [
-            "pre_settle",
-            "open", "high", "low", "close",
-            "vol", "amount", "oi",
-        ]
-        main_preprocess(
-            universe=pro_cfg.universe,
-            bgn_date=bgn_date,
-            stp_date=stp_date,
-            vol_alpha=pro_cfg.vol_alpha,
+            pos_fea_top_ns=pro_cfg.pos_fea_top_ns,
             db_struct_fmd=db_struct_cfg.fmd,
             db_struct_basis=db_struct_cfg.basis,
             db_struct_stock=db_struct_cfg.stock,
             db_struct_preprocess=db_struct_cfg.preprocess,
+            db_struct_roll=db_struct_cfg.roll,
+            vol_alpha=pro_cfg.vol_alpha,
             slc_vars=slc_vars,
-            calendar=calendar,
-            call_multiprocess=not args.nomp,
-        )
-    elif args.switch == "minute_bar":
-        from solutions.minute_bar import main_minute_bar
-
-        main_minute_bar(
-            universe=pro_cfg.universe,
             src_data_root_dir=pro_cfg.daily_data_root_dir,
             src_data_file_name_tmpl=pro_cfg.minute_bar_data_file_name_tmpl,
-            db_struct_preprocess=db_struct_cfg.preprocess,
             db_struct_minute_bar=db_struct_cfg.minute_bar,
-            bgn_date=bgn_date,
-            stp_date=stp_date,
-            calendar=calendar,
-            call_multiprocess=not args.nomp,
-            processes=args.processes,
+            perf_ledger_path=pro_cfg.perf_ledger_path,
         )
+        serve.main(interval=args.interval)
     else:
-        raise ValueError(f"args.switch = {args.switch} is illegal")
+        from solutions.perf import CPerfRun
+
+        bgn_date = args.bgn  # None for queue-work, which takes dates from work units
+        stp_date = args.stp or (bgn_date and calendar.get_next_date(bgn_date, shift=1))
+        with CPerfRun(args.switch, bgn_date, stp_date, ledger_path=pro_cfg.perf_ledger_path) as perf_run:
+            if args.switch == "macro":
+                from solutions.alternative import main_macro
+
+                main_macro(
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    path_macro_data=pro_cfg.path_macro_data,
+                    db_struct_macro=db_struct_cfg.macro,
+                    calendar=calendar,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "forex":
+                from solutions.alternative import main_forex
+
+                main_forex(
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    path_forex_data=pro_cfg.path_forex_data,
+                    db_struct_forex=db_struct_cfg.forex,
+                    calendar=calendar,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "position":
+                from solutions.position import main_position_by_instru
+
+                main_position_by_instru(
+                    universe=pro_cfg.universe,
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    calendar=calendar,
+                    pos_db_struct=db_struct_cfg.position,
+                    pos_by_instru_save_dir=pro_cfg.by_instru_pos_dir,
+                    pos_fea_db_struct=db_struct_cfg.position_feature,
+                    top_ns=pro_cfg.pos_fea_top_ns,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "preprocess":
+                from solutions.preprocess import main_preprocess
+
+                main_preprocess(
+                    universe=pro_cfg.universe,
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    vol_alphas=[pro_cfg.vol_alpha] + [z for z in args.alphas if z != pro_cfg.vol_alpha],
+                    db_struct_fmd=db_struct_cfg.fmd,
+                    db_struct_basis=db_struct_cfg.basis,
+                    db_struct_stock=db_struct_cfg.stock,
+                    db_struct_preprocess=db_struct_cfg.preprocess,
+                    db_struct_roll=db_struct_cfg.roll,
+                    slc_vars=slc_vars,
+                    calendar=calendar,
+                    call_multiprocess=not args.nomp,
+                    processes=args.processes,
+                    ram_budget=pro_cfg.ram_budget,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "minute_bar":
+                from solutions.minute_bar import main_minute_bar
+
+                main_minute_bar(
+                    universe=pro_cfg.universe,
+                    src_data_root_dir=pro_cfg.daily_data_root_dir,
+                    src_data_file_name_tmpl=pro_cfg.minute_bar_data_file_name_tmpl,
+                    db_struct_preprocess=db_struct_cfg.preprocess,
+                    db_struct_minute_bar=db_struct_cfg.minute_bar,
+                    db_struct_roll=db_struct_cfg.roll,
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    calendar=calendar,
+                    call_multiprocess=not args.nomp,
+                    processes=args.processes,
+                    ram_budget=pro_cfg.ram_budget,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "minute_panel":
+                from solutions.minute_panel import main_minute_panel
+
+                main_minute_panel(
+                    universe=pro_cfg.universe,
+                    panel_dir=pro_cfg.minute_panel_dir,
+                    db_struct_minute_bar=db_struct_cfg.minute_bar,
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    calendar=calendar,
+                    perf_run=perf_run,
+                )
+            elif args.switch == "queue-submit":
+                from solutions.workqueue import CWorkQueue
+
+                CWorkQueue(queue_path=pro_cfg.queue_path, lease_seconds=args.lease).submit(
+                    universe=pro_cfg.universe,
+                    stages=args.stages,
+                    deps={"minute_bar": ["preprocess"]},
+                    bgn_date=bgn_date,
+                    stp_date=stp_date,
+                    chunk=args.chunk,
+                    calendar=calendar,
+                )
+            elif args.switch == "queue-work":
+                from functools import partial
+                from solutions.workqueue import main_queue_work
+                from solutions.preprocess import process_stats_for_instru
+                from solutions.minute_bar import process_minute_bar_for_instru
+
+                handlers = {
+                    "preprocess": partial(
+                        process_stats_for_instru,
+                        vol_alphas=[pro_cfg.vol_alpha],
+                        slc_vars=slc_vars,
+                        db_struct_fmd=db_struct_cfg.fmd,
+                        db_struct_basis=db_struct_cfg.basis,
+                        db_struct_stock=db_struct_cfg.stock,
+                        db_struct_preprocess=db_struct_cfg.preprocess,
+                        calendar=calendar,
+                    ),
+                    "minute_bar": partial(
+                        process_minute_bar_for_instru,
+                        src_data_root_dir=pro_cfg.daily_data_root_dir,
+                        src_data_file_name_tmpl=pro_cfg.minute_bar_data_file_name_tmpl,
+                        db_struct_preprocess=db_struct_cfg.preprocess,
+                        db_struct_minute_bar=db_struct_cfg.minute_bar,
+                        calendar=calendar,
+                    ),
+                }
+                main_queue_work(
+                    queue_path=pro_cfg.queue_path,
+                    lease_seconds=args.lease,
+                    handlers=handlers,
+                    call_multiprocess=not args.nomp,
+                    processes=args.processes,
+                    perf_run=perf_run,
+                )
+            else:
+                raise ValueError(f"args.switch = {args.switch} is illegal")
@@ -16,10 +16,16 @@ class CProCfg:
     alternative_dir: str
     universe: list[str]
     by_instru_pos_dir: str
+    by_instru_pos_fea_dir: str
     by_instru_pre_dir: str
     by_instru_min_dir: str
+    minute_panel_dir: str
     minute_bar_data_file_name_tmpl: str
     vol_alpha: float
+    perf_ledger_path: str
+    queue_path: str
+    pos_fea_top_ns: tuple[int, ...]
+    ram_budget: int  # bytes, for multiprocess pools of preprocess and minute_bar
 
 
 universe: list[str] = [
@@ -114,10 +120,16 @@ pro_cfg = CProCfg(
     alternative_dir=r"E:\OneDrive\Data\Alternative",
     universe=universe,
     by_instru_pos_dir=r"E:\OneDrive\Data\tushare\by_instrument\position",
+    by_instru_pos_fea_dir=r"E:\OneDrive\Data\tushare\by_instrument\position_feature",
     by_instru_pre_dir=r"E:\OneDrive\Data\tushare\by_instrument\preprocess",
     by_instru_min_dir=r"E:\OneDrive\Data\tushare\by_instrument\minute_bar",
+    minute_panel_dir=r"E:\OneDrive\Data\tushare\minute_panel",
     minute_bar_data_file_name_tmpl="tushare_futures_minute_bar_{}.csv.gz",
     vol_alpha=0.9,
+    perf_ledger_path=r"E:\OneDrive\Data\tushare\perf_ledger.jsonl",
+    queue_path=r"E:\OneDrive\Data\tushare\queue\work_queue.db",
+    pos_fea_top_ns=(5, 10, 20),
+    ram_budget=24 * 2 ** 30,
 )
 
 # ---------- databases structure ----------
@@ -131,9 +143,11 @@ class CDbStructCfg:
     forex: CDbStruct
     fmd: CDbStruct
     position: CDbStruct
+    position_feature: CDbStruct
     basis: CDbStruct
     stock: CDbStruct
     preprocess: CDbStruct
+    roll: CDbStruct
     minute_bar: CDbStruct
 
 
@@ -158,6 +172,19 @@ db_struct_cfg = CDbStructCfg(
         db_name=db_struct["position"]["db_name"],
         table=CSqlTable(cfg=db_struct["position"]["table"]),
     ),
+    position_feature=CDbStruct(
+        db_save_dir=pro_cfg.by_instru_pos_fea_dir,
+        db_name="position_feature.db",
+        table=CSqlTable(cfg={
+            "name": "position_feature",
+            "primary_keys": {"trade_date": "TEXT"},
+            "value_columns": {
+                f"{v}_top{n}": "REAL"
+                for n in pro_cfg.pos_fea_top_ns
+                for v in ("long", "short", "net", "net_chg", "long_conc", "short_conc")
+            },
+        }),
+    ),
     basis=CDbStruct(
         db_save_dir=pro_cfg.root_dir,
         db_name=db_struct["basis"]["db_name"],
@@ -173,6 +200,15 @@ db_struct_cfg = CDbStructCfg(
         db_name=db_struct["preprocess"]["db_name"],
         table=CSqlTable(cfg=db_struct["preprocess"]["table"]),
     ),
+    roll=CDbStruct(
+        db_save_dir=pro_cfg.by_instru_pre_dir,
+        db_name="roll.db",
+        table=CSqlTable(cfg={
+            "name": "roll",
+            "primary_keys": {"trade_date": "TEXT", "instrument": "TEXT"},
+            "value_columns": {"ticker_major": "TEXT", "ticker_minor": "TEXT"},
+        }),
+    ),
     minute_bar=CDbStruct(
         db_save_dir=pro_cfg.by_instru_min_dir,
         db_name=db_struct["fMinuteBar"]["db_name"],
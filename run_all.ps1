@@ -6,3 +6,4 @@ python main.py --bgn $bgn_date --stp $stp_date --switch forex
 python main.py --bgn $bgn_date --stp $stp_date --switch position
 python main.py --bgn $bgn_date --stp $stp_date --switch preprocess
 python main.py --bgn $bgn_date --stp $stp_date --switch minute_bar
+python main.py --switch perf-report
@@ -0,0 +1,151 @@
+import threading
+from typing import Any, Callable
+import numpy as np
+import pandas as pd
+from loguru import logger
+from husfort.qutility import SFG, SFR, SFY
+from solutions.perf import load_ledger
+
+"""
+Memory-aware admission of tasks to a multiprocess pool.
+
+The memory of a task is modeled as base + bytes_per_unit * src_size, where src_size is a
+cheap measure of its source data, known before the task runs, such as fmd rows of an
+instrument. Both parameters are fitted from task_rss and src_size of the previous runs of
+the same stage in the perf ledger, per instrument if it has history. Defaults are used
+before any history is recorded.
+"""
+
+# history of each stage used to fit the model, number of runs
+HISTORY_RUNS = 10
+
+# rss of an idle spawned worker with pandas imported, used before any history is recorded
+DEFAULT_BASE_RSS = 200 * 2 ** 20
+
+
+class CMemEstimator:
+    def __init__(
+            self, ledger_path: str, stage: str, default_bytes_per_unit: float, default_base: int = DEFAULT_BASE_RSS
+    ):
+        """
+        params: default_bytes_per_unit: bytes of memory per unit of src_size
+        params: default_base: rss of an idle worker, in bytes
+
+        """
+        self.stage = stage
+        self.base: float = default_base
+        self.bytes_per_unit: float = default_bytes_per_unit
+        self.instru_bytes_per_unit: dict[str, float] = {}
+        self.fit(ledger_path)
+
+    def fit(self, ledger_path: str) -> None:
+        ledger = load_ledger(ledger_path)
+        if ledger.empty or "tasks" not in ledger:
+            return None
+        records = ledger.loc[ledger["stage"] == self.stage, "tasks"].iloc[-HISTORY_RUNS:]
+        tasks = pd.DataFrame([t for run_tasks in records for t in run_tasks])
+        if tasks.empty or not {"src_size", "task_rss"}.issubset(tasks.columns):
+            return None
+        tasks = tasks[(tasks["src_size"] > 0) & (tasks["task_rss"] > 0)]
+        if tasks.empty:
+            logger.warning(
+                f"No task of {SFR(self.stage)} in the perf ledger has task_rss and src_size, "
+                f"rss may be unavailable on this platform, memory model runs on defaults"
+            )
+            return None
+        self.base = float(tasks["task_rss"].min())
+        tasks["bytes_per_unit"] = (tasks["task_rss"] - self.base) / tasks["src_size"]
+        self.bytes_per_unit = float(tasks["bytes_per_unit"].median())
+        # the latest run of each instrument
+        self.instru_bytes_per_unit = tasks.groupby(by="instrument")["bytes_per_unit"].last().to_dict()
+        logger.info(
+            f"Memory model of {SFG(self.stage)} fitted from {len(tasks)} tasks: "
+            f"base = {SFY(f'{self.base / 2 ** 20:.0f}')}MB, "
+            f"{SFY(f'{self.bytes_per_unit:.1f}')} bytes per unit"
+        )
+        return None
+
+    def estimate(self, instrument: str, src_size: int) -> int:
+        bytes_per_unit = self.instru_bytes_per_unit.get(instrument, self.bytes_per_unit)
+        return int(self.base + bytes_per_unit * src_size)
+
+
+class CMemScheduler:
+    """
+    Submit tasks to a pool while the projected memory of admitted tasks stays under budget,
+    and at most processes tasks are admitted at a time. Each time a task finishes, the first
+    pending task that fits is admitted, so small tasks could fill the room left by large ones.
+    A task larger than budget is admitted only when nothing else is running.
+    """
+
+    def __init__(self, budget: int, processes: int):
+        self.budget = budget
+        self.processes = processes
+        self.projected: int = 0
+        self.running: int = 0
+        self.max_projected: int = 0
+        self.__cond = threading.Condition()
+
+    def __release(self, estimate: int) -> None:
+        with self.__cond:
+            self.projected -= estimate
+            self.running -= 1
+            self.__cond.notify_all()
+
+    def __pick(self, pending: list[tuple[str, dict, int, int]]) -> int | None:
+        if self.running >= self.processes:
+            return None
+        for i, (_, _, _, estimate) in enumerate(pending):
+            if self.running == 0 or self.projected + estimate <= self.budget:
+                return i
+        return None
+
+    def run(
+            self, pool, func: Callable,
+            tasks: list[tuple[str, dict, int, int]],
+            callback: Callable[[Any, int], None],
+            error_callback: Callable[[BaseException], None],
+    ) -> None:
+        """
+        params: tasks: [(instrument, kwds of func, src_size, estimate)], larger tasks are admitted first
+        params: callback: called as callback(result of func, src_size) when each task finishes,
+                it should record src_size in CTaskStats of the task for later fits
+
+        """
+        pending = sorted(tasks, key=lambda z: z[3], reverse=True)
+        while pending:
+            with self.__cond:
+                while (i := self.__pick(pending)) is None:
+                    self.__cond.wait()
+                instrument, kwds, src_size, estimate = pending.pop(i)
+                self.projected += estimate
+                self.running += 1
+                self.max_projected = max(self.max_projected, self.projected)
+
+            def __callback(result: Any, _src_size: int = src_size, _estimate: int = estimate):
+                self.__release(_estimate)
+                callback(result, _src_size)
+
+            def __error_callback(e: BaseException, _estimate: int = estimate):
+                self.__release(_estimate)
+                error_callback(e)
+
+            pool.apply_async(func, kwds=kwds, callback=__callback, error_callback=__error_callback)
+        with self.__cond:
+            while self.running > 0:
+                self.__cond.wait()
+        logger.info(
+            f"Max projected memory = {SFY(f'{self.max_projected / 2 ** 30:.2f}')}GB, "
+            f"budget = {SFY(f'{self.budget / 2 ** 30:.2f}')}GB"
+        )
+        return None
+
+
+def summarize_estimates(stage: str, tasks: list[tuple[str, dict, int, int]]) -> None:
+    estimates = np.array([z[3] for z in tasks], dtype=np.float64)
+    if estimates.size > 0:
+        logger.info(
+            f"Estimated memory of {SFG(stage)} tasks: max = {SFY(f'{estimates.max() / 2 ** 20:.0f}')}MB, "
+            f"median = {SFY(f'{np.median(estimates) / 2 ** 20:.0f}')}MB"
+        )
+    return None
@@ -1,8 +1,11 @@
+import numpy as np
 import pandas as pd
 from loguru import logger
 from husfort.qutility import qtimer, SFG
-from husfort.qcalendar import CCalendar
 from husfort.qsqlite import CMgrSqlDb, CDbStruct
+from solutions.perf import CTaskTimer, CPerfRun
+from solutions.calendar_index import CCalendarIndex
+from solutions.shared import to_date_key, to_sql_dates
 
 """
 Part I: Macro data: cpi, m2, ppi
@@ -13,16 +16,16 @@ def load_macro_data(path_macro_data: str) -> pd.DataFrame:
     return pd.read_excel(path_macro_data, sheet_name="china_cpi_m2")
 
 
-def reformat_macro(macro_data: pd.DataFrame, hist_bgn_month: str, calendar: CCalendar) -> pd.DataFrame:
+def reformat_macro(macro_data: pd.DataFrame, hist_bgn_month: str, calendar: CCalendarIndex) -> pd.DataFrame:
     macro_data["trade_month"] = macro_data["trade_month"].map(lambda z: z.strftime("%Y%m"))
-    macro_data["available_month"] = macro_data["trade_month"].map(lambda z: calendar.get_next_month(z, s=2))
+    macro_data["available_month"] = calendar.shift_months(macro_data["trade_month"], s=2).astype(np.int32)
     macro_data.set_index(keys="trade_month", inplace=True)
     macro_data = macro_data.truncate(before=hist_bgn_month)
     return macro_data
 
 
 def merge_macro(reformat_data: pd.DataFrame, dates_header: pd.DataFrame, names: list[str]):
-    dates_header["available_month"] = dates_header["trade_date"].map(lambda z: z[0:6])
+    dates_header["available_month"] = dates_header["trade_date"] // 100
     res = pd.merge(
         left=dates_header,
         right=reformat_data,
@@ -38,7 +41,8 @@ def main_macro(
         stp_date: str,
         path_macro_data: str,
         db_struct_macro: CDbStruct,
-        calendar: CCalendar,
+        calendar: CCalendarIndex,
+        perf_run: CPerfRun,
 ):
     sqldb = CMgrSqlDb(
         db_save_dir=db_struct_macro.db_save_dir,
@@ -46,14 +50,18 @@ def main_macro(
         table=db_struct_macro.table,
         mode="a",
     )
-    if sqldb.check_continuity(incoming_date=bgn_date, calendar=calendar) == 0:
-        macro_data = load_macro_data(path_macro_data=path_macro_data)
-        rft_data = reformat_macro(macro_data=macro_data, hist_bgn_month="201111", calendar=calendar)
-        dates_header = calendar.get_dates_header(bgn_date, stp_date)
-        new_macro_data = merge_macro(rft_data, dates_header=dates_header, names=db_struct_macro.table.vars.names)
-        sqldb.update(update_data=new_macro_data)
-        logger.info(f"{SFG('Macro data')} by dates updated")
-        print(new_macro_data)
+    with CTaskTimer("macro") as task:
+        if sqldb.check_continuity(incoming_date=bgn_date, calendar=calendar) == 0:
+            macro_data = load_macro_data(path_macro_data=path_macro_data)
+            rft_data = reformat_macro(macro_data=macro_data, hist_bgn_month="201111", calendar=calendar)
+            dates_header = calendar.get_keys_header(bgn_date, stp_date)
+            new_macro_data = merge_macro(rft_data, dates_header=dates_header, names=db_struct_macro.table.vars.names)
+            new_macro_data = to_sql_dates(new_macro_data)
+            sqldb.update(update_data=new_macro_data)
+            task.stats.rows_read, task.stats.rows_written = len(macro_data), len(new_macro_data)
+            logger.info(f"{SFG('Macro data')} by dates updated")
+            print(new_macro_data)
+    perf_run.add(task.stats)
     return 0
 
 
@@ -67,7 +75,7 @@ def load_forex_data(path_forex_data: str) -> pd.DataFrame:
 
 
 def reformat_forex(forex_data: pd.DataFrame) -> pd.DataFrame:
-    forex_data["trade_date"] = forex_data["Date"].map(lambda z: z.strftime("%Y%m%d"))
+    forex_data["trade_date"] = to_date_key(forex_data["Date"].map(lambda z: z.strftime("%Y%m%d")))
     return forex_data
 
 
@@ -88,7 +96,8 @@ def main_forex(
         stp_date: str,
         path_forex_data: str,
         db_struct_forex: CDbStruct,
-        calendar: CCalendar,
+        calendar: CCalendarIndex,
+        perf_run: CPerfRun,
 ):
     sqldb = CMgrSqlDb(
         db_save_dir=db_struct_forex.db_save_dir,
@@ -96,12 +105,16 @@ def main_forex(
         table=db_struct_forex.table,
         mode="a"
     )
-    if sqldb.check_continuity(incoming_date=bgn_date, calendar=calendar) == 0:
-        forex_data = load_forex_data(path_forex_data=path_forex_data)
-        rft_data = reformat_forex(forex_data=forex_data)
-        dates_header = calendar.get_dates_header(bgn_date, stp_date)
-        new_forex_data = merge_forex(rft_data, dates_header=dates_header, names=db_struct_forex.table.vars.names)
-        sqldb.update(update_data=new_forex_data)
-        logger.info(f"{SFG('Forex data')} by dates updated")
-        print(new_forex_data)
+    with CTaskTimer("forex") as task:
+        if sqldb.check_continuity(incoming_date=bgn_date, calendar=calendar) == 0:
+            forex_data = load_forex_data(path_forex_data=path_forex_data)
+            rft_data = reformat_forex(forex_data=forex_data)
+            dates_header = calendar.get_keys_header(bgn_date, stp_date)
+            new_forex_data = merge_forex(rft_data, dates_header=dates_header, names=db_struct_forex.table.vars.names)
+            new_forex_data = to_sql_dates(new_forex_data)
+            sqldb.update(update_data=new_forex_data)
+            task.stats.rows_read, task.stats.rows_written = len(forex_data), len(new_forex_data)
+            logger.info(f"{SFG('Forex data')} by dates updated")
+            print(new_forex_data)
+    perf_run.add(task.stats)
     return 0
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from husfort.qcalendar import CCalendar
+
+
+class CCalendarIndex(CCalendar):
+    """
+    Trading dates held in a sorted numpy array with a date -> position map, built once
+    from the trade dates loaded by CCalendar. Offsets and range lookups are O(1) map hits or array slices,
+    vectorized versions are provided for whole columns of dates or months.
+
+    It is a drop-in replacement of CCalendar. When pickled to workers, only the
+    array is sent, the map and the list of CCalendar are rebuilt on arrival.
+    """
+
+    def __init__(self, calendar_path: str):
+        super().__init__(calendar_path)
+        self.dates: np.ndarray = np.array(self.trade_dates, dtype="U8")
+        # attribute of CCalendar which holds the list, None if it is not found
+        self.base_key: str | None = next((k for k, v in self.__dict__.items() if v is self.trade_dates), None)
+        self.__build()
+
+    def __build(self):
+        self.keys: np.ndarray = self.dates.astype(np.int32)
+        self.pos_map: dict[str, int] = {d: i for i, d in enumerate(self.dates.tolist())}
+        self.headers: dict[tuple[str, str, str], pd.DataFrame] = {}
+        self.keys_headers: dict[tuple[str, str, str], pd.DataFrame] = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["keys"], state["pos_map"], state["headers"], state["keys_headers"]
+        if self.base_key is not None:
+            del state[self.base_key]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if self.base_key is not None:
+            self.__dict__[self.base_key] = self.dates.tolist()
+        self.__build()
+
+    def position(self, date: str) -> int:
+        """
+        return: position of date in calendar, for a non-trading date,
+                position of the first trading date after it
+
+        """
+        if (pos := self.pos_map.get(date)) is not None:
+            return pos
+        return int(np.searchsorted(self.dates, date, side="left"))
+
+    def positions(self, dates: np.ndarray | list[str]) -> np.ndarray:
+        return np.searchsorted(self.dates, np.asarray(dates, dtype="U8"), side="left")
+
+    def __at(self, pos: np.ndarray | int) -> np.ndarray | str:
+        if np.any(pos < 0) or np.any(pos >= len(self.dates)):
+            raise IndexError(f"shifted dates are out of calendar [{self.dates[0]}, {self.dates[-1]}]")
+        return self.dates[pos]
+
+    def get_next_date(self, this_date: str, shift: int = 1) -> str:
+        pos = self.position(this_date)
+        if shift > 0 and self.pos_map.get(this_date) is None:
+            # the first trading date after a non-trading date is its next date
+            shift -= 1
+        return str(self.__at(pos + shift))
+
+    def offset(self, dates: np.ndarray | list[str], shift: int) -> np.ndarray:
+        """
+        params: dates: trading dates
+
+        return: dates shifted by shift trading days
+
+        """
+        return self.__at(self.positions(dates) + shift)
+
+    def slice_range(self, bgn_date: str, stp_date: str) -> np.ndarray:
+        """
+        return: trading dates in [bgn_date, stp_date), a view of the calendar array
+
+        """
+        return self.dates[self.position(bgn_date):self.position(stp_date)]
+
+    def get_iter_list(self, bgn_date: str, stp_date: str, ascending: bool = True) -> list[str]:
+        iter_list = self.slice_range(bgn_date, stp_date).tolist()
+        return iter_list if ascending else iter_list[::-1]
+
+    def get_dates_header(self, bgn_date: str, stp_date: str, header_name: str = "trade_date") -> pd.DataFrame:
+        """
+        headers are built once for each range and a copy is returned, as callers may add columns to it
+
+        """
+        key = (bgn_date, stp_date, header_name)
+        if (dates_header := self.headers.get(key)) is None:
+            dates_header = self.headers[key] = pd.DataFrame({header_name: self.get_iter_list(bgn_date, stp_date)})
+        return dates_header.copy()
+
+    def get_keys_header(self, bgn_date: str, stp_date: str, header_name: str = "trade_date") -> pd.DataFrame:
+        """
+        same as get_dates_header, but dates are int32 keys, see solutions.shared
+
+        """
+        key = (bgn_date, stp_date, header_name)
+        if (keys_header := self.keys_headers.get(key)) is None:
+            keys = self.keys[self.position(bgn_date):self.position(stp_date)]
+            keys_header = self.keys_headers[key] = pd.DataFrame({header_name: keys})
+        return keys_header.copy()
+
+    @staticmethod
+    def shift_months(months: np.ndarray | pd.Series | list[str], s: int) -> np.ndarray:
+        """
+        params: months: format = [YYYYMM]
+
+        return: months shifted by s months, format = [YYYYMM]
+
+        """
+        m = np.asarray(months, dtype="U6").astype(np.int32)
+        k = (m // 100) * 12 + (m % 100 - 1) + s
+        return ((k // 12) * 100 + k % 12 + 1).astype("U6")
+
+    def get_next_month(self, month: str, s: int) -> str:
+        return str(self.shift_months([month], s)[0])
@@ -0,0 +1,105 @@
+import os
+import time
+import sqlite3
+import pathlib
+from dataclasses import dataclass
+import pandas as pd
+from husfort.qsqlite import CDbStruct
+
+
+@dataclass
+class CDbPoolStats:
+    opens: int = 0
+    reuses: int = 0
+    queries: int = 0
+    query_time: float = 0
+    max_query_time: float = 0
+
+
+class CDbPool:
+    """
+    Read-only connections to source databases, keyed by (db_save_dir, db_name) and kept
+    open for the life of the process, so each worker opens every source db once.
+    Range queries are parameterized, sqlite3 caches their prepared statements per connection.
+
+    Use the module level db_pool, which is created once in each process.
+    """
+
+    def __init__(self):
+        self.connections: dict[tuple[str, str], sqlite3.Connection] = {}
+        self.stats: dict[tuple[str, str], CDbPoolStats] = {}
+        self.mmap_sizes: dict[tuple[str, str], int] = {}
+
+    def get(self, db_struct: CDbStruct, mmap_size: int = 0) -> sqlite3.Connection:
+        """
+        params: mmap_size: bytes of memory-mapped I/O, 0 to disable. If a connection is reused with
+                a larger mmap_size than it has, its mmap_size is raised, it is never lowered
+
+        """
+        key = (db_struct.db_save_dir, db_struct.db_name)
+        stats = self.stats.setdefault(key, CDbPoolStats())
+        if (conn := self.connections.get(key)) is not None:
+            stats.reuses += 1
+        else:
+            db_path = pathlib.Path(os.path.join(db_struct.db_save_dir, db_struct.db_name)).resolve()
+            conn = sqlite3.connect(f"{db_path.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self.connections[key] = conn
+            self.mmap_sizes[key] = 0
+            stats.opens += 1
+        if mmap_size > self.mmap_sizes[key]:
+            conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+            self.mmap_sizes[key] = mmap_size
+        return conn
+
+    def read_range(
+            self, db_struct: CDbStruct, bgn_date: str, stp_date: str,
+            conditions: list[tuple[str, str]] = None, value_columns: list[str] = None,
+            mmap_size: int = 0,
+    ) -> pd.DataFrame:
+        """
+        params: conditions: [(column, value)], rows with column = value
+        params: value_columns: columns to select, all columns if None
+
+        return: rows with bgn_date <= trade_date < stp_date
+
+        """
+        cols = ", ".join(value_columns) if value_columns else "*"
+        where = ["trade_date >= ?", "trade_date < ?"] + [f"{col} = ?" for col, _ in conditions or []]
+        sql = f"SELECT {cols} FROM {db_struct.table.name} WHERE {' AND '.join(where)}"
+        params = [bgn_date, stp_date] + [val for _, val in conditions or []]
+        return self.query(db_struct, sql, params, mmap_size=mmap_size)
+
+    def query(self, db_struct: CDbStruct, sql: str, params: list = None, mmap_size: int = 0) -> pd.DataFrame:
+        conn = self.get(db_struct, mmap_size=mmap_size)
+        t0 = time.perf_counter()
+        cur = conn.execute(sql, params or [])
+        data = pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+        elapsed = time.perf_counter() - t0
+        stats = self.stats[(db_struct.db_save_dir, db_struct.db_name)]
+        stats.queries += 1
+        stats.query_time += elapsed
+        stats.max_query_time = max(stats.max_query_time, elapsed)
+        return data
+
+    def last_date(self, db_struct: CDbStruct) -> str | None:
+        data = self.query(db_struct, f"SELECT MAX(trade_date) AS trade_date FROM {db_struct.table.name}")
+        return data["trade_date"].iloc[0]
+
+    def total(self) -> CDbPoolStats:
+        return CDbPoolStats(
+            opens=sum(s.opens for s in self.stats.values()),
+            reuses=sum(s.reuses for s in self.stats.values()),
+            queries=sum(s.queries for s in self.stats.values()),
+            query_time=sum(s.query_time for s in self.stats.values()),
+            max_query_time=max([s.max_query_time for s in self.stats.values()], default=0),
+        )
+
+    def close(self) -> None:
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+        self.mmap_sizes.clear()
+
+
+db_pool = CDbPool()
@@ -1,6 +1,8 @@
 import os
+import json
 import datetime as dt
 import multiprocessing as mp
+from typing import Callable, Iterator
 import numpy as np
 import pandas as pd
 from loguru import logger
@@ -8,36 +10,108 @@ from rich.progress import track, Progress
 from husfort.qutility import SFG, SFR, check_and_makedirs, error_handler
 from husfort.qcalendar import CCalendar
 from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from solutions.perf import CTaskStats, CTaskTimer, CPerfRun
+from solutions.snapshot import get_watermark
+from solutions.shared import date_key, from_sql_dates
+from solutions.dbpool import db_pool
+from solutions.admission import CMemEstimator, CMemScheduler, summarize_estimates
+from solutions.roll import CRollTable
+from solutions.normalize import UNIT_COLS, adjust_units, parse_timestamps
 
 logger.add(f"logs/minute_bar_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
 
+# memory per byte of the largest compressed day file in range, used before any history is recorded
+MEM_BYTES_PER_SRC_BYTE = 60
+
+
+def get_minute_data_path(src_data_root_dir: str, src_data_file_name_tmpl: str, trade_date: str) -> str:
+    src_file = src_data_file_name_tmpl.format(trade_date)
+    return os.path.join(src_data_root_dir, trade_date[0:4], trade_date, src_file)
+
+
+def get_minute_data_size(src_data_root_dir: str, src_data_file_name_tmpl: str, trade_dates: list[str]) -> int:
+    """
+    return: size of the largest day file of trade_dates, in bytes. A task holds decoded
+            files of 2 days at most, so its memory scales with the largest one, not the sum
+
+    """
+    sizes = [0]
+    for trade_date in trade_dates:
+        src_path = get_minute_data_path(src_data_root_dir, src_data_file_name_tmpl, trade_date)
+        if os.path.exists(src_path):
+            sizes.append(os.path.getsize(src_path))
+    return max(sizes)
+
+
+def get_checkpoint_path(dst_db_struct: CDbStruct) -> str:
+    checkpoint_file = os.path.splitext(dst_db_struct.db_name)[0] + ".checkpoint.json"
+    return os.path.join(dst_db_struct.db_save_dir, checkpoint_file)
+
+
+def load_checkpoint(dst_db_struct: CDbStruct) -> str | None:
+    """
+    return: the last date processed into dst_db_struct, which is later than the watermark of it
+            if the last days have no minute data. None if there is no checkpoint or it does not
+            match the watermark
+
+    """
+    checkpoint_path = get_checkpoint_path(dst_db_struct)
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as f:
+        checkpoint = json.load(f)
+    sqldb = CMgrSqlDb(
+        db_save_dir=dst_db_struct.db_save_dir,
+        db_name=dst_db_struct.db_name,
+        table=dst_db_struct.table,
+        mode="a",
+    )
+    if checkpoint["watermark"] != get_watermark(sqldb):
+        logger.info(f"Checkpoint of {SFR(dst_db_struct.db_name)} does not match its db, it is ignored")
+        return None
+    return checkpoint["trade_date"]
+
 
 class CMinuteBarInstru:
     def __init__(
             self, instrument: str, src_data_root_dir: str, src_data_file_name_tmpl: str,
-            preprocess_db_struct: CDbStruct, dst_db_struct: CDbStruct
+            preprocess_db_struct: CDbStruct, dst_db_struct: CDbStruct,
+            flush_days: int = 20, flush_rows: int = 200_000,
+            roll_data: pd.DataFrame | None = None,
+            fence: Callable[[], None] | None = None,
     ):
+        """
+        params: flush_days, flush_rows: minute data is written to dst db and checkpointed
+                whenever flush_days days or flush_rows rows are accumulated
+        params: roll_data: rows of this instrument from roll table, with columns = ["trade_date", "ticker_major"]
+                at least, if None, major tickers are read from preprocess db
+        params: fence: called right before each write to dst db, given by queue workers, see solutions.workqueue
+
+        """
         self.instrument = instrument
         self.src_data_file_name_tmpl = src_data_file_name_tmpl
         self.src_data_root_dir = src_data_root_dir
         self.preprocess_db_struct = preprocess_db_struct
         self.dst_db_struct = dst_db_struct
+        self.flush_days = flush_days
+        self.flush_rows = flush_rows
+        self.roll_data = roll_data
+        self.fence = fence
 
-        self.major_ticker_data: pd.DataFrame = pd.DataFrame()
+        self.major_tickers: dict[int, str | None] = {}
 
     def init_major_ticker(self, bgn_date: str, stp_date: str) -> None:
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.preprocess_db_struct.db_save_dir,
-            db_name=self.preprocess_db_struct.db_name,
-            table=self.preprocess_db_struct.table,
-            mode="r",
-        )
-        data = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "ticker_major"])
-        self.major_ticker_data = data.set_index("trade_date")
+        if self.roll_data is None:
+            data = db_pool.read_range(
+                self.preprocess_db_struct, bgn_date, stp_date, value_columns=["trade_date", "ticker_major"]
+            )
+            data = from_sql_dates(data)
+        else:
+            data = self.roll_data
+        self.major_tickers = dict(zip(data["trade_date"].tolist(), data["ticker_major"].tolist()))
 
     def load_minute_data(self, trade_date: str, contract: str) -> pd.DataFrame:
-        src_file = self.src_data_file_name_tmpl.format(trade_date)
-        src_path = os.path.join(self.src_data_root_dir, trade_date[0:4], trade_date, src_file)
+        src_path = get_minute_data_path(self.src_data_root_dir, self.src_data_file_name_tmpl, trade_date)
         if os.path.exists(src_path):
             minute_data = pd.read_csv(src_path, dtype={"trade_date": str, "timestamp": str})
             contract_minute_data = minute_data.query(f"ts_code == '{contract}'")
@@ -47,8 +121,8 @@ class CMinuteBarInstru:
             logger.info(f"There is no minute data for {SFR(trade_date)}/{SFR(contract)}")
         return contract_minute_data
 
-    def get_ticker_major(self, trade_date: str) -> str:
-        return self.major_ticker_data.at[trade_date, "ticker_major"]
+    def get_ticker_major(self, trade_date: str) -> str | None:
+        return self.major_tickers.get(date_key(trade_date))
 
     @staticmethod
     def add_prev_price(prev_minute_data: pd.DataFrame, this_minute_data: pd.DataFrame) -> pd.DataFrame:
@@ -70,19 +144,19 @@ class CMinuteBarInstru:
             return pd.DataFrame()
 
         # --- timestamp
-        raw_data["timestamp"] = raw_data["timestamp"].map(
-            lambda z: dt.datetime.strptime(z, "%Y-%m-%d %H:%M:%S").timestamp()).astype("int64")
+        raw_data["timestamp"] = parse_timestamps(raw_data["timestamp"])
 
         # --- vol adjustment
-        _vol_adj_date: str = "20200101"
-        _exempt_instruments = ["IH", "IF", "IC", "IM", "TF", "TS", "T", "TL"]
-        _vol_cols = ["vol", "amount", "oi"]
-        instru, exchange = self.instrument.split(".")
-        if (instru not in _exempt_instruments) and (trade_date < _vol_adj_date):
-            raw_data[_vol_cols] = raw_data[_vol_cols] / 2
+        trade_dates = np.full(len(raw_data), date_key(trade_date), dtype=np.int32)
+        code = self.instrument.split(".")[0]
+        adjust_units(raw_data, code, cols=UNIT_COLS, trade_dates=trade_dates)
         return raw_data[self.dst_db_struct.table.vars.names]
 
-    def save(self, instru_minute_data: pd.DataFrame, calendar: CCalendar) -> None:
+    def save(self, instru_minute_data: pd.DataFrame, calendar: CCalendar) -> int:
+        """
+        return: number of rows written
+
+        """
         sqldb = CMgrSqlDb(
             db_save_dir=self.dst_db_struct.db_save_dir,
             db_name=self.dst_db_struct.db_name,
@@ -90,27 +164,119 @@ class CMinuteBarInstru:
             mode="a",
         )
         if sqldb.check_continuity(incoming_date=instru_minute_data["trade_date"].iloc[0], calendar=calendar) <= 1:
+            if self.fence is not None:
+                self.fence()
             sqldb.update(update_data=instru_minute_data)
+            return len(instru_minute_data)
+        return 0
 
-    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> None:
-        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
-        prev_dates = [calendar.get_next_date(iter_dates[0], -1)] + iter_dates[:-1]
-        self.init_major_ticker(bgn_date=bgn_date, stp_date=stp_date)
-        dfs: list[pd.DataFrame] = []
+    @property
+    def checkpoint_path(self) -> str:
+        return get_checkpoint_path(self.dst_db_struct)
+
+    def load_checkpoint(self) -> str | None:
+        """
+        return: the last date committed to dst db, if the checkpoint matches the watermark of dst db
+
+        """
+        return load_checkpoint(self.dst_db_struct)
+
+    def save_checkpoint(self, trade_date: str) -> None:
+        sqldb = CMgrSqlDb(
+            db_save_dir=self.dst_db_struct.db_save_dir,
+            db_name=self.dst_db_struct.db_name,
+            table=self.dst_db_struct.table,
+            mode="a",
+        )
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"trade_date": trade_date, "watermark": get_watermark(sqldb)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def iter_minute_data(
+            self, iter_dates: list[str], prev_dates: list[str], task_stats: CTaskStats
+    ) -> Iterator[tuple[str, pd.DataFrame]]:
+        """
+        yield: (trade_date, minute data of trade_date), minute data may be empty
+
+        """
         for this_date, prev_date in zip(iter_dates, prev_dates):
             major_ticker = self.get_ticker_major(trade_date=this_date)
             if major_ticker is None:
                 logger.info(f"There is no ticker for {SFR(this_date)}/{SFR(self.instrument)}")
+                yield this_date, pd.DataFrame()
                 continue
             prev_minute_data = self.load_minute_data(trade_date=prev_date, contract=major_ticker)
             this_minute_data = self.load_minute_data(trade_date=this_date, contract=major_ticker)
+            task_stats.rows_read += len(this_minute_data)
             raw_data = self.add_prev_price(prev_minute_data, this_minute_data)
-            new_data = self.reformat(raw_data, trade_date=this_date)
+            yield this_date, self.reformat(raw_data, trade_date=this_date)
+
+    def iter_batches(
+            self, minute_data: Iterator[tuple[str, pd.DataFrame]]
+    ) -> Iterator[tuple[str, list[pd.DataFrame]]]:
+        """
+        yield: (last trade_date of this batch, non-empty minute data in this batch)
+
+        """
+        dfs: list[pd.DataFrame] = []
+        n_days, n_rows, last_date = 0, 0, ""
+        for last_date, new_data in minute_data:
             if not new_data.empty:
                 dfs.append(new_data)
-        if dfs:
-            instru_minute_data = pd.concat(dfs, axis=0, ignore_index=True)
-            self.save(instru_minute_data, calendar)
+                n_rows += len(new_data)
+            n_days += 1
+            if n_days >= self.flush_days or n_rows >= self.flush_rows:
+                yield last_date, dfs
+                dfs, n_days, n_rows = [], 0, 0
+        if n_days > 0:
+            yield last_date, dfs
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> CTaskStats:
+        with CTaskTimer(self.instrument) as task:
+            if (committed_date := self.load_checkpoint()) is not None and committed_date >= bgn_date:
+                logger.info(f"Resume {SFG(self.instrument)} from the day after {SFG(committed_date)}")
+                bgn_date = calendar.get_next_date(committed_date, shift=1)
+            iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+            if not iter_dates:
+                return task.stats
+            prev_dates = [calendar.get_next_date(iter_dates[0], -1)] + iter_dates[:-1]
+            self.init_major_ticker(bgn_date=bgn_date, stp_date=stp_date)
+            minute_data = self.iter_minute_data(iter_dates, prev_dates, task.stats)
+            for last_date, dfs in self.iter_batches(minute_data):
+                if dfs:
+                    instru_minute_data = pd.concat(dfs, axis=0, ignore_index=True)
+                    if (rows_written := self.save(instru_minute_data, calendar)) == 0:
+                        logger.warning(f"Minute data of {SFR(self.instrument)} to {SFR(last_date)} is not saved")
+                        continue
+                    task.stats.rows_written += rows_written
+                self.save_checkpoint(last_date)
+        return task.stats
+
+
+def process_minute_bar_for_instru(
+        instru: str,
+        bgn_date: str,
+        stp_date: str,
+        src_data_root_dir: str,
+        src_data_file_name_tmpl: str,
+        db_struct_preprocess: CDbStruct,
+        db_struct_minute_bar: CDbStruct,
+        calendar: CCalendar,
+        roll_data: pd.DataFrame | None = None,
+        fence: Callable[[], None] | None = None,
+) -> CTaskStats:
+    check_and_makedirs(db_struct_minute_bar.db_save_dir)
+    minute_bar_instru = CMinuteBarInstru(
+        instrument=instru,
+        src_data_root_dir=src_data_root_dir,
+        src_data_file_name_tmpl=src_data_file_name_tmpl,
+        preprocess_db_struct=db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"),
+        dst_db_struct=db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db"),
+        roll_data=roll_data,
+        fence=fence,
+    )
+    return minute_bar_instru.main(bgn_date, stp_date, calendar)
 
 
 def main_minute_bar(
@@ -119,35 +285,69 @@ def main_minute_bar(
         src_data_file_name_tmpl: str,
         db_struct_preprocess: CDbStruct,
         db_struct_minute_bar: CDbStruct,
+        db_struct_roll: CDbStruct,
         bgn_date: str, stp_date: str, calendar: CCalendar,
         call_multiprocess: bool,
-        processes: int,
+        processes: int | None,
+        ram_budget: int,
+        perf_run: CPerfRun,
 ) -> None:
-    check_and_makedirs(db_struct_minute_bar.db_save_dir)
-    minute_bar_instruments = [
-        CMinuteBarInstru(
-            instrument=instru,
-            src_data_root_dir=src_data_root_dir,
-            src_data_file_name_tmpl=src_data_file_name_tmpl,
-            preprocess_db_struct=db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"),
-            dst_db_struct=db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db")
-        ) for instru in universe
-    ]
+    """
+    params: ram_budget: bytes, tasks are admitted to the pool only while their
+            estimated memory in total stays under it, see solutions.admission
 
+    """
+    check_and_makedirs(db_struct_minute_bar.db_save_dir)
+    rolls = CRollTable(db_struct_roll, db_struct_preprocess).load(universe, bgn_date, stp_date)
     desc = f"Creating major {SFG('minute bar')} by instruments"
     if call_multiprocess:
+        processes = processes or mp.cpu_count()
+        src_size = get_minute_data_size(
+            src_data_root_dir, src_data_file_name_tmpl,
+            trade_dates=[calendar.get_next_date(bgn_date, -1)] + calendar.get_iter_list(bgn_date, stp_date),
+        )
+        estimator = CMemEstimator(perf_run.ledger_path, "minute_bar", default_bytes_per_unit=MEM_BYTES_PER_SRC_BYTE)
+        tasks = []
+        for instru in universe:
+            kwds = {
+                "instru": instru,
+                "bgn_date": bgn_date,
+                "stp_date": stp_date,
+                "src_data_root_dir": src_data_root_dir,
+                "src_data_file_name_tmpl": src_data_file_name_tmpl,
+                "db_struct_preprocess": db_struct_preprocess,
+                "db_struct_minute_bar": db_struct_minute_bar,
+                "calendar": calendar,
+                "roll_data": rolls.get(instru),
+            }
+            tasks.append((instru, kwds, src_size, estimator.estimate(instru, src_size)))
+        summarize_estimates("minute_bar", tasks)
+
         with Progress() as pb:
             task_id = pb.add_task(description=desc, total=len(universe))
+
+            def __callback(task_stats: CTaskStats, src_size: int):
+                task_stats.src_size = src_size
+                perf_run.add(task_stats)
+                pb.update(task_id, advance=1)
+
             with mp.get_context("spawn").Pool(processes) as pool:
-                for minute_bar_instru in minute_bar_instruments:
-                    pool.apply_async(
-                        minute_bar_instru.main,
-                        args=(bgn_date, stp_date, calendar),
-                        callback=lambda _: pb.update(task_id, advance=1),
-                        error_callback=error_handler,
-                    )
+                scheduler = CMemScheduler(budget=ram_budget, processes=processes)
+                scheduler.run(
+                    pool, process_minute_bar_for_instru, tasks, callback=__callback, error_callback=error_handler
+                )
                 pool.close()
                 pool.join()
     else:
+        minute_bar_instruments = [
+            CMinuteBarInstru(
+                instrument=instru,
+                src_data_root_dir=src_data_root_dir,
+                src_data_file_name_tmpl=src_data_file_name_tmpl,
+                preprocess_db_struct=db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"),
+                dst_db_struct=db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db"),
+                roll_data=rolls.get(instru),
+            ) for instru in universe
+        ]
         for minute_bar_instru in track(minute_bar_instruments, description=desc):
-            minute_bar_instru.main(bgn_date, stp_date, calendar)
+            perf_run.add(minute_bar_instru.main(bgn_date, stp_date, calendar))
@@ -0,0 +1,252 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from loguru import logger
+from rich.progress import track
+from numpy.lib.format import open_memmap
+from husfort.qutility import SFG, SFR, SFY, check_and_makedirs
+from husfort.qsqlite import CDbStruct
+from solutions.calendar_index import CCalendarIndex
+from solutions.dbpool import db_pool
+from solutions.perf import CTaskTimer, CPerfRun
+from solutions.shared import from_sql_dates
+from solutions.minute_bar import load_checkpoint
+
+"""
+Minute bars of all instruments aligned on a common minute grid, one (time x instrument)
+array per field, saved as .npy files which could be opened with np.load(mmap_mode="r").
+
+panel_dir/
+    close.npy, return.npy, vol.npy, oi.npy: float64, shape = (capacity, instruments)
+    timestamps.npy: int64, shape = (capacity,), the grid, unix seconds
+    trade_dates.npy: int32, shape = (capacity,), trade date key of each grid row
+    meta.json: {"instruments": [...], "rows": rows in use, "last_date": "YYYYMMDD"}
+
+The grid of a day is the union of timestamps of all instruments, missing minutes are NaN.
+Only rows before meta["rows"] are valid, files are preallocated and grow by doubling, so new
+days are appended in place. meta.json is replaced after arrays are flushed, rows beyond it
+are overwritten by the next run.
+"""
+
+PANEL_FIELDS = ("close", "return", "vol", "oi")
+PANEL_INIT_CAPACITY = 2 ** 16
+
+
+class CMinutePanel:
+    """
+    panel = CMinutePanel(panel_dir)
+    close = panel.slice("close", "20240101", "20240201")  # a read-only view, no copy
+
+    """
+
+    def __init__(self, panel_dir: str):
+        self.panel_dir = panel_dir
+        with open(os.path.join(panel_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.instruments: list[str] = meta["instruments"]
+        self.rows: int = meta["rows"]
+        self.last_date: str = meta["last_date"]
+        self.timestamps: np.ndarray = self.__load("timestamps")
+        self.trade_dates: np.ndarray = self.__load("trade_dates")
+
+    def __load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.panel_dir, f"{name}.npy"), mmap_mode="r")[:self.rows]
+
+    def field(self, name: str) -> np.ndarray:
+        return self.__load(name)
+
+    def slice(self, name: str, bgn_date: str, stp_date: str) -> np.ndarray:
+        """
+        return: rows of trade dates in [bgn_date, stp_date)
+
+        """
+        i, j = np.searchsorted(self.trade_dates, [int(bgn_date), int(stp_date)], side="left")
+        return self.field(name)[i:j]
+
+
+class CMinutePanelWriter:
+    def __init__(self, panel_dir: str, universe: list[str], db_struct_minute_bar: CDbStruct):
+        self.panel_dir = panel_dir
+        self.universe = universe
+        self.db_struct_minute_bar = db_struct_minute_bar
+        self.rows: int = 0
+        self.last_date: str | None = None
+        self.rows_read: int = 0
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.panel_dir, "meta.json")
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.panel_dir, f"{name}.npy")
+
+    def get_arrays(self) -> dict[str, tuple[np.dtype, tuple[int, ...]]]:
+        """
+        return: {name: (dtype, shape of one row)}
+
+        """
+        arrays = {f: (np.dtype(np.float64), (len(self.universe),)) for f in PANEL_FIELDS}
+        arrays["timestamps"] = (np.dtype(np.int64), ())
+        arrays["trade_dates"] = (np.dtype(np.int32), ())
+        return arrays
+
+    def load_meta(self) -> None:
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["instruments"] != self.universe:
+            raise ValueError(
+                f"Instruments of minute panel in {self.panel_dir} are different from universe, "
+                f"remove the directory and rebuild it"
+            )
+        self.rows, self.last_date = meta["rows"], meta["last_date"]
+        return None
+
+    def save_meta(self) -> None:
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"instruments": self.universe, "rows": self.rows, "last_date": self.last_date}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def reserve(self, rows: int) -> None:
+        """
+        make sure every array has capacity for rows, grow it by doubling if not
+
+        """
+        for name, (dtype, row_shape) in self.get_arrays().items():
+            path = self.get_path(name)
+            if os.path.exists(path):
+                capacity = np.load(path, mmap_mode="r").shape[0]
+                if capacity >= rows:
+                    continue
+                new_capacity = max(capacity * 2, rows)
+            else:
+                capacity, new_capacity = 0, max(PANEL_INIT_CAPACITY, rows)
+            tmp_path = path + ".tmp"
+            new_array = open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(new_capacity,) + row_shape)
+            if capacity > 0:
+                new_array[:self.rows] = np.load(path, mmap_mode="r")[:self.rows]
+            new_array.flush()
+            del new_array
+            os.replace(tmp_path, path)
+            logger.info(f"Capacity of {SFG(name)} grows from {capacity} to {SFY(new_capacity)} rows")
+        return None
+
+    def get_stp_date(self, stp_date: str, calendar: CCalendarIndex) -> str:
+        """
+        return: stp_date capped by the day after the earliest date processed into minute bar dbs,
+                so no day is appended before every instrument has been updated. The date is read
+                from the checkpoint of each db, so instruments without minute data in the last
+                days do not hold the panel back
+
+        """
+        for instru in self.universe:
+            db_struct_instru = self.db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db")
+            if not os.path.exists(os.path.join(db_struct_instru.db_save_dir, db_struct_instru.db_name)):
+                logger.warning(f"There is no minute bar db for {SFR(instru)}, it is ignored in minute panel")
+                continue
+            if (processed_date := load_checkpoint(db_struct_instru) or db_pool.last_date(db_struct_instru)) is None:
+                continue
+            if (instru_stp_date := calendar.get_next_date(processed_date, shift=1)) < stp_date:
+                logger.info(f"Minute panel stops at {SFY(instru_stp_date)}, limited by {SFY(instru)}")
+                stp_date = instru_stp_date
+        return stp_date
+
+    def load_minute_bar(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+        return: a pd.DataFrame with columns =
+                ["trade_date", "timestamp", "col", "close", "return", "vol", "oi"],
+                col is the position of the instrument in universe
+
+        """
+        dfs: list[pd.DataFrame] = []
+        for col, instru in enumerate(self.universe):
+            db_struct_instru = self.db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db")
+            if not os.path.exists(os.path.join(db_struct_instru.db_save_dir, db_struct_instru.db_name)):
+                continue
+            data = db_pool.read_range(
+                db_struct_instru, bgn_date, stp_date,
+                value_columns=["trade_date", "timestamp", "close", "pre_close", "vol", "oi"],
+            )
+            if not data.empty:
+                dfs.append(from_sql_dates(data).assign(col=col))
+        if not dfs:
+            return pd.DataFrame()
+        data = pd.concat(dfs, axis=0, ignore_index=True)
+        self.rows_read += len(data)
+        close, pre_close = data["close"].to_numpy(np.float64), data["pre_close"].to_numpy(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            data["return"] = np.where(pre_close > 0, close / pre_close - 1, 0)
+        return data
+
+    def append(self, data: pd.DataFrame) -> int:
+        """
+        return: number of grid rows appended
+
+        """
+        grid, rows_idx = np.unique(data["timestamp"].to_numpy(np.int64), return_inverse=True)
+        grid_dates = np.zeros(len(grid), dtype=np.int32)
+        grid_dates[rows_idx] = data["trade_date"].to_numpy(np.int32)
+        self.reserve(self.rows + len(grid))
+        bgn, end = self.rows, self.rows + len(grid)
+        cols_idx = data["col"].to_numpy()
+        for name in PANEL_FIELDS:
+            array = np.load(self.get_path(name), mmap_mode="r+")
+            block = np.full((len(grid), len(self.universe)), np.nan)
+            block[rows_idx, cols_idx] = data[name].to_numpy(np.float64)
+            array[bgn:end] = block
+            array.flush()
+            del array
+        for name, values in (("timestamps", grid), ("trade_dates", grid_dates)):
+            array = np.load(self.get_path(name), mmap_mode="r+")
+            array[bgn:end] = values
+            array.flush()
+            del array
+        self.rows = end
+        return len(grid)
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendarIndex, batch_days: int = 20) -> int:
+        """
+        params: batch_days: number of trading days loaded and appended each time
+
+        return: number of grid rows appended
+
+        """
+        check_and_makedirs(self.panel_dir)
+        self.load_meta()
+        if self.last_date is not None:
+            if bgn_date <= self.last_date:
+                logger.info(f"Minute panel has been updated to {SFY(self.last_date)}, only later days are appended")
+            bgn_date = max(bgn_date, calendar.get_next_date(self.last_date, shift=1))
+        stp_date = self.get_stp_date(stp_date, calendar)
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        appended = 0
+        batches = [iter_dates[i:i + batch_days] for i in range(0, len(iter_dates), batch_days)]
+        for batch_dates in track(batches, description=f"Appending {SFG('minute panel')}"):
+            batch_stp_date = calendar.get_next_date(batch_dates[-1], shift=1)
+            data = self.load_minute_bar(batch_dates[0], batch_stp_date)
+            if not data.empty:
+                appended += self.append(data)
+            self.last_date = batch_dates[-1]
+            self.save_meta()
+        return appended
+
+
+def main_minute_panel(
+        universe: list[str],
+        panel_dir: str,
+        db_struct_minute_bar: CDbStruct,
+        bgn_date: str,
+        stp_date: str,
+        calendar: CCalendarIndex,
+        perf_run: CPerfRun,
+) -> None:
+    with CTaskTimer("minute_panel") as task:
+        writer = CMinutePanelWriter(panel_dir, universe, db_struct_minute_bar)
+        task.stats.rows_written = writer.main(bgn_date, stp_date, calendar)
+        task.stats.rows_read = writer.rows_read
+    perf_run.add(task.stats)
+    logger.info(f"{SFG(task.stats.rows_written)} minutes appended to minute panel, {SFG(writer.rows)} in total")
+    return None
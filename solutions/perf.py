@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import datetime as dt
+from dataclasses import dataclass, asdict
+from typing import Any, Callable
+import numpy as np
+import pandas as pd
+from loguru import logger
+from rich.console import Console
+from rich.table import Table
+from husfort.qutility import SFG, SFR, SFY, check_and_makedirs
+from solutions.dbpool import db_pool, CDbPoolStats
+
+
+@functools.cache
+def get_win_memory_info() -> Callable[[], Any]:
+    """
+    return: a function which returns PROCESS_MEMORY_COUNTERS of this process by
+            GetProcessMemoryInfo of psapi, only available on windows
+
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    class CProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    kernel32, psapi = ctypes.WinDLL("kernel32"), ctypes.WinDLL("psapi")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [
+        wintypes.HANDLE, ctypes.POINTER(CProcessMemoryCounters), wintypes.DWORD,
+    ]
+    psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+    def __get() -> CProcessMemoryCounters:
+        counters = CProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            raise ctypes.WinError()
+        return counters
+
+    return __get
+
+
+@functools.cache
+def warn_rss_unavailable(reason: str) -> None:
+    logger.warning(f"RSS is not available, it is recorded as NaN: {SFR(reason)}")
+    return None
+
+
+def get_peak_rss() -> float:
+    """
+    return: peak resident set size of this process, in bytes, which is the peak working set
+            on windows, NaN if it is not available
+
+    """
+    if sys.platform == "win32":
+        try:
+            return get_win_memory_info()().PeakWorkingSetSize
+        except OSError as e:
+            warn_rss_unavailable(f"GetProcessMemoryInfo failed, {e}")
+            return np.nan
+    import resource
+
+    ru_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return ru_maxrss if sys.platform == "darwin" else ru_maxrss * 1024
+
+
+def get_rss() -> float:
+    """
+    return: current resident set size of this process, in bytes, which is the working set
+            on windows, NaN if it is not available
+
+    """
+    if sys.platform == "win32":
+        try:
+            return get_win_memory_info()().WorkingSetSize
+        except OSError as e:
+            warn_rss_unavailable(f"GetProcessMemoryInfo failed, {e}")
+            return np.nan
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:  # not linux
+        try:
+            import psutil
+        except ImportError:
+            warn_rss_unavailable("there is no /proc/self/statm and psutil is not installed")
+            return np.nan
+        return psutil.Process().memory_info().rss
+
+
+def nan_max(values: list[float]) -> float:
+    """
+    return: max of values which are not NaN, NaN if there is none
+
+    """
+    return max((z for z in values if not np.isnan(z)), default=np.nan)
+
+
+class CRssSampler:
+    """
+    sample rss of this process in a background thread, peak is the max sampled rss.
+    Unlike get_peak_rss, it is not the peak of the whole process life, so it measures
+    one task in a reused worker. Spikes shorter than interval may be missed.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak: float = 0
+        self.__stop = threading.Event()
+        self.__thread: threading.Thread | None = None
+
+    def __sample(self):
+        while not self.__stop.wait(self.interval):
+            self.peak = nan_max([self.peak, get_rss()])
+
+    def __enter__(self) -> "CRssSampler":
+        self.peak = get_rss()
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.__stop.set()
+        self.__thread.join()
+        self.peak = nan_max([self.peak, get_rss()])
+        return False
+
+
+@dataclass
+class CTaskStats:
+    """
+    stats of one task, usually one instrument, returned by workers to the main process
+
+    peak_rss: peak rss of the worker process until the end of this task, NaN if not available
+    task_rss: peak rss of the worker process during this task, see CRssSampler, NaN if not available
+    src_size: source size estimated by the scheduler before the task, see solutions.admission
+    """
+    instrument: str
+    rows_read: int = 0
+    rows_written: int = 0
+    cpu_time: float = 0
+    peak_rss: float = 0
+    task_rss: float = 0
+    src_size: int = 0
+    db_opens: int = 0
+    db_reuses: int = 0
+    db_queries: int = 0
+    db_query_time: float = 0
+
+
+class CTaskTimer:
+    """
+    with CTaskTimer(instrument) as task:
+        task.stats.rows_read += len(data)
+    return task.stats
+
+    """
+
+    def __init__(self, instrument: str):
+        self.stats = CTaskStats(instrument=instrument)
+        self.__cpu_t0: float = 0
+        self.__db_t0: CDbPoolStats = CDbPoolStats()
+        self.__rss_sampler = CRssSampler()
+
+    def __enter__(self) -> "CTaskTimer":
+        self.__cpu_t0 = time.process_time()
+        self.__db_t0 = db_pool.total()
+        self.__rss_sampler.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.__rss_sampler.__exit__(exc_type, exc_val, exc_tb)
+        self.stats.cpu_time = time.process_time() - self.__cpu_t0
+        self.stats.peak_rss = get_peak_rss()
+        self.stats.task_rss = self.__rss_sampler.peak
+        db_t1 = db_pool.total()
+        self.stats.db_opens = db_t1.opens - self.__db_t0.opens
+        self.stats.db_reuses = db_t1.reuses - self.__db_t0.reuses
+        self.stats.db_queries = db_t1.queries - self.__db_t0.queries
+        self.stats.db_query_time = db_t1.query_time - self.__db_t0.query_time
+        return False
+
+
+class CPerfRun:
+    """
+    measure one run of main.py and append a record to the ledger when it exits without error.
+    Wall time is measured in the main process, cpu time and peak rss include workers via CTaskStats.
+    """
+
+    def __init__(self, stage: str, bgn_date: str, stp_date: str, ledger_path: str):
+        self.stage = stage
+        self.bgn_date = bgn_date
+        self.stp_date = stp_date
+        self.ledger_path = ledger_path
+        self.tasks: list[CTaskStats] = []
+        self.__wall_t0: float = 0
+        self.__cpu_t0: float = 0
+        self.__run_time: str = ""
+
+    def add(self, task_stats: CTaskStats) -> None:
+        self.tasks.append(task_stats)
+
+    def __enter__(self) -> "CPerfRun":
+        self.__run_time = dt.datetime.now().strftime("%Y%m%d %H:%M:%S")
+        self.__wall_t0 = time.perf_counter()
+        self.__cpu_t0 = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is None:
+            wall_time = time.perf_counter() - self.__wall_t0
+            main_cpu_time = time.process_time() - self.__cpu_t0
+            record = {
+                "run_time": self.__run_time,
+                "stage": self.stage,
+                "bgn_date": self.bgn_date,
+                "stp_date": self.stp_date,
+                "instruments": len(self.tasks),
+                "rows_read": sum(t.rows_read for t in self.tasks),
+                "rows_written": sum(t.rows_written for t in self.tasks),
+                "wall_time": wall_time,
+                "cpu_time": main_cpu_time + sum(t.cpu_time for t in self.tasks),
+                "peak_rss": nan_max([get_peak_rss()] + [t.peak_rss for t in self.tasks]),
+                "db_opens": sum(t.db_opens for t in self.tasks),
+                "db_reuses": sum(t.db_reuses for t in self.tasks),
+                "db_queries": sum(t.db_queries for t in self.tasks),
+                "db_query_time": sum(t.db_query_time for t in self.tasks),
+                "tasks": [asdict(t) for t in self.tasks],
+            }
+            append_ledger(self.ledger_path, record)
+            if record["db_queries"] > 0:
+                logger.info(
+                    f"Source db: {record['db_queries']} queries, "
+                    f"avg latency {record['db_query_time'] / record['db_queries'] * 1e3:.2f}ms, "
+                    f"{record['db_opens']} connections opened, {record['db_reuses']} reused"
+                )
+        return False
+
+
+def append_ledger(ledger_path: str, record: dict) -> None:
+    check_and_makedirs(os.path.dirname(ledger_path))
+    with open(ledger_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def load_ledger(ledger_path: str) -> pd.DataFrame:
+    if not os.path.exists(ledger_path):
+        return pd.DataFrame()
+    with open(ledger_path, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records)
+
+
+def report_perf(ledger_path: str, window: int, threshold: float) -> int:
+    """
+    params: window: number of previous runs of the same stage used as baseline, runs with no
+            rows read or written are reported as "no work" and left out of baselines
+    params: threshold: a stage is flagged when its wall or cpu time per row exceeds
+            the median of the baseline by more than this ratio
+
+    return: number of stages flagged
+
+    """
+    ledger = load_ledger(ledger_path)
+    if ledger.empty:
+        logger.info(f"There is no record in {SFY(ledger_path)}")
+        return 0
+
+    # runs with no rows read or written, such as re-runs of dates already in dbs, have no per-row cost
+    rows = ledger["rows_read"] + ledger["rows_written"]
+    ledger["rows"] = rows
+    ledger["wall_per_row"] = ledger["wall_time"] / rows.where(rows > 0)
+    ledger["cpu_per_row"] = ledger["cpu_time"] / rows.where(rows > 0)
+    table = Table(title=f"Performance report, baseline = last {window} runs, threshold = {threshold:.0%}")
+    for col in ("stage", "run_time", "range", "rows", "wall(s)", "us/row(wall)", "us/row(cpu)", "peak_rss(MB)",
+                "chg(wall)", "chg(cpu)", "flag"):
+        table.add_column(col, justify="right")
+
+    regressions = 0
+    for stage, stage_data in ledger.groupby(by="stage", sort=True):
+        latest = stage_data.iloc[-1]
+        if latest["rows"] == 0:
+            table.add_row(
+                stage,
+                latest["run_time"],
+                f"{latest['bgn_date']}->{latest['stp_date']}",
+                "0",
+                f"{latest['wall_time']:.2f}",
+                "-", "-",
+                f"{latest['peak_rss'] / 2 ** 20:.1f}",
+                "-", "-",
+                "no work",
+            )
+            continue
+        baseline = stage_data.iloc[:-1]
+        baseline = baseline[baseline["rows"] > 0].iloc[-window:]
+        if baseline.empty:
+            chg_wall, chg_cpu = np.nan, np.nan
+        else:
+            chg_wall = latest["wall_per_row"] / baseline["wall_per_row"].median() - 1
+            chg_cpu = latest["cpu_per_row"] / baseline["cpu_per_row"].median() - 1
+        flagged = (chg_wall > threshold) or (chg_cpu > threshold)
+        regressions += int(flagged)
+        table.add_row(
+            stage,
+            latest["run_time"],
+            f"{latest['bgn_date']}->{latest['stp_date']}",
+            f"{latest['rows']:,}",
+            f"{latest['wall_time']:.2f}",
+            f"{latest['wall_per_row'] * 1e6:.2f}",
+            f"{latest['cpu_per_row'] * 1e6:.2f}",
+            f"{latest['peak_rss'] / 2 ** 20:.1f}",
+            f"{chg_wall:+.1%}",
+            f"{chg_cpu:+.1%}",
+            "[red]REGRESSION[/red]" if flagged else "",
+        )
+        if flagged:
+            logger.warning(
+                f"Stage {SFR(stage)} is slower than baseline: "
+                f"wall/row {SFR(f'{chg_wall:+.1%}')}, cpu/row {SFR(f'{chg_cpu:+.1%}')}"
+            )
+    Console().print(table)
+    if regressions == 0:
+        logger.info(f"{SFG('No regression')} found")
+    return regressions
@@ -4,28 +4,70 @@ from rich.progress import track
 from husfort.qutility import check_and_makedirs, SFG, qtimer
 from husfort.qcalendar import CCalendar
 from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from solutions.perf import CTaskStats, CTaskTimer, CPerfRun
+from solutions.shared import date_key, from_sql_dates, to_sql_dates
+from solutions.snapshot import get_watermark
+from solutions.calendar_index import CCalendarIndex
+from solutions.dbpool import db_pool
+
+
+def cal_position_features(pos_data: pd.DataFrame, top_ns: tuple[int, ...]) -> pd.DataFrame:
+    """
+    params: pos_data: raw positions of an instrument, with columns =
+            ["trade_date", "broker", "long_hld", "short_hld"] at least, a broker may
+            appear in several contracts of the same date
+    params: top_ns: features are calculated on the top n brokers ranked by holdings
+
+    return: a pd.DataFrame with trade_date as index and columns =
+            [f"{v}_top{n}" for n in top_ns for v in ("long", "short", "net", "long_conc", "short_conc")]
+            long and short are summed separately from their own rankings, so net is
+            the net long holding of the top n long brokers against the top n short brokers.
+
+    """
+    broker_data = pos_data.groupby(by=["trade_date", "broker"], as_index=False)[["long_hld", "short_hld"]].sum()
+    grp = broker_data.groupby(by="trade_date")
+    long_rank = grp["long_hld"].rank(method="first", ascending=False)
+    short_rank = grp["short_hld"].rank(method="first", ascending=False)
+    total = grp[["long_hld", "short_hld"]].sum()
+    features = {}
+    for n in top_ns:
+        top_long = broker_data["long_hld"].where(long_rank <= n, 0).groupby(broker_data["trade_date"]).sum()
+        top_short = broker_data["short_hld"].where(short_rank <= n, 0).groupby(broker_data["trade_date"]).sum()
+        features[f"long_top{n}"] = top_long
+        features[f"short_top{n}"] = top_short
+        features[f"net_top{n}"] = top_long - top_short
+        features[f"long_conc_top{n}"] = top_long / total["long_hld"].where(total["long_hld"] > 0)
+        features[f"short_conc_top{n}"] = top_short / total["short_hld"].where(total["short_hld"] > 0)
+    return pd.DataFrame(features)
 
 
 class CPosInstru:
-    def __init__(self, instrument: str, src_db_struct: CDbStruct, dst_db_struct: CDbStruct):
+    def __init__(
+            self, instrument: str, src_db_struct: CDbStruct, dst_db_struct: CDbStruct,
+            fea_db_struct: CDbStruct, top_ns: tuple[int, ...],
+    ):
+        """
+        params: fea_db_struct: db of daily position features, see cal_position_features
+
+        """
         self.instrument = instrument
         self.src_db_struct = src_db_struct
         self.dst_db_struct = dst_db_struct
+        self.fea_db_struct = fea_db_struct
+        self.top_ns = top_ns
 
     def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.src_db_struct.db_save_dir,
-            db_name=self.src_db_struct.db_name,
-            table=self.src_db_struct.table,
-            mode="r"
+        data = db_pool.read_range(
+            self.src_db_struct, bgn_date, stp_date, conditions=[("instrument", self.instrument)]
         )
-        data = sqldb.read_by_instrument_range(bgn_date=bgn_date, stp_date=stp_date, instrument=self.instrument)
-        return data
+        return from_sql_dates(data)
 
-    def align_dates(self, new_data: pd.DataFrame, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+    def align_dates(
+            self, new_data: pd.DataFrame, bgn_date: str, stp_date: str, calendar: CCalendarIndex
+    ) -> pd.DataFrame:
         if new_data.empty:
             logger.info(f"There is no data for {SFG(self.instrument)} from {SFG(bgn_date)} to {SFG(stp_date)}")
-        dates_header = calendar.get_dates_header(bgn_date, stp_date)
+        dates_header = calendar.get_keys_header(bgn_date, stp_date)
         aligned_data = pd.merge(
             left=dates_header,
             right=new_data,
@@ -34,33 +76,123 @@ class CPosInstru:
         )
         return aligned_data
 
-    def save(self, aligned_data: pd.DataFrame, calendar: CCalendar):
+    def get_fea_bgn_date(self, bgn_date: str, calendar: CCalendar) -> str:
+        """
+        return: the day after the watermark of the feature db, if it is behind bgn_date, else bgn_date
+
+        """
+        sqldb = CMgrSqlDb(
+            db_save_dir=self.fea_db_struct.db_save_dir,
+            db_name=self.fea_db_struct.db_name,
+            table=self.fea_db_struct.table,
+            mode="a"
+        )
+        if (watermark := get_watermark(sqldb)) is None:
+            return bgn_date
+        return min(bgn_date, calendar.get_next_date(watermark, shift=1))
+
+    def cal_features(
+            self, new_data: pd.DataFrame, fea_bgn_date: str, stp_date: str, calendar: CCalendarIndex
+    ) -> pd.DataFrame:
+        """
+        params: new_data: raw positions from the trading day before fea_bgn_date,
+                which is needed for the day-over-day changes
+
+        """
+        base_date = calendar.get_next_date(fea_bgn_date, -1)
+        dates_header = calendar.get_keys_header(base_date, stp_date)
+        features = cal_position_features(new_data, top_ns=self.top_ns)
+        aligned_features = pd.merge(
+            left=dates_header,
+            right=features,
+            left_on="trade_date",
+            right_index=True,
+            how="left",
+        )
+        for n in self.top_ns:
+            aligned_features[f"net_chg_top{n}"] = aligned_features[f"net_top{n}"].diff()
+        aligned_features = aligned_features.iloc[1:]
+        return aligned_features[self.fea_db_struct.table.vars.names]
+
+    @staticmethod
+    def save(aligned_data: pd.DataFrame, db_struct: CDbStruct, calendar: CCalendar) -> int:
+        """
+        return: number of rows written
+
+        """
         sqldb = CMgrSqlDb(
-            db_save_dir=self.dst_db_struct.db_save_dir,
-            db_name=self.dst_db_struct.db_name,
-            table=self.dst_db_struct.table,
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
             mode="a"
         )
+        aligned_data = to_sql_dates(aligned_data)
         if sqldb.check_continuity(incoming_date=aligned_data["trade_date"].iloc[0], calendar=calendar) == 0:
             sqldb.update(update_data=aligned_data)
+            return len(aligned_data)
         return 0
 
-    def main_position(self, bgn_date: str, stp_date: str, calendar: CCalendar):
-        new_data = self.load(bgn_date, stp_date)
-        aligned_data = self.align_dates(new_data, bgn_date, stp_date, calendar)
-        self.save(aligned_data, calendar)
-        return 0
+    def main_position(self, bgn_date: str, stp_date: str, calendar: CCalendarIndex) -> CTaskStats:
+        """
+        raw positions are loaded once, from the earlier of bgn_date and the feature db watermark,
+        then split to the instrument db and reduced to features in the same pass
+
+        """
+        with CTaskTimer(self.instrument) as task:
+            fea_bgn_date = self.get_fea_bgn_date(bgn_date, calendar)
+            load_bgn_date = calendar.get_next_date(fea_bgn_date, -1)
+            all_data = self.load(load_bgn_date, stp_date)
+            task.stats.rows_read += len(all_data)
+
+            new_data = all_data[all_data["trade_date"] >= date_key(bgn_date)]
+            aligned_data = self.align_dates(new_data, bgn_date, stp_date, calendar)
+            task.stats.rows_written += self.save(aligned_data, self.dst_db_struct, calendar)
+
+            fea_data = self.cal_features(all_data, fea_bgn_date, stp_date, calendar)
+            task.stats.rows_written += self.save(fea_data, self.fea_db_struct, calendar)
+        return task.stats
+
+
+def process_position_for_instru(
+        instru: str,
+        bgn_date: str,
+        stp_date: str,
+        pos_db_struct: CDbStruct,
+        pos_by_instru_save_dir: str,
+        pos_fea_db_struct: CDbStruct,
+        top_ns: tuple[int, ...],
+        calendar: CCalendarIndex,
+) -> CTaskStats:
+    instru_pos = CPosInstru(
+        instru,
+        src_db_struct=pos_db_struct,
+        dst_db_struct=pos_db_struct.copy_to_another(pos_by_instru_save_dir, another_db_name=f"{instru}.db"),
+        fea_db_struct=pos_fea_db_struct.copy_to_another(another_db_name=f"{instru}.db"),
+        top_ns=top_ns,
+    )
+    return instru_pos.main_position(bgn_date, stp_date, calendar)
 
 
 @qtimer
 def main_position_by_instru(
         universe: list[str],
-        bgn_date: str, stp_date: str, calendar: CCalendar,
-        pos_db_struct: CDbStruct, pos_by_instru_save_dir: str
+        bgn_date: str, stp_date: str, calendar: CCalendarIndex,
+        pos_db_struct: CDbStruct, pos_by_instru_save_dir: str,
+        pos_fea_db_struct: CDbStruct, top_ns: tuple[int, ...],
+        perf_run: CPerfRun,
 ):
     check_and_makedirs(pos_by_instru_save_dir)
+    check_and_makedirs(pos_fea_db_struct.db_save_dir)
     for instru in track(universe, description=f"Splitting {SFG('positions')} to instruments"):
-        instru_pos_db_struct = pos_db_struct.copy_to_another(pos_by_instru_save_dir, another_db_name=f"{instru}.db")
-        instru_pos = CPosInstru(instru, src_db_struct=pos_db_struct, dst_db_struct=instru_pos_db_struct)
-        instru_pos.main_position(bgn_date, stp_date, calendar)
+        task_stats = process_position_for_instru(
+            instru=instru,
+            bgn_date=bgn_date,
+            stp_date=stp_date,
+            pos_db_struct=pos_db_struct,
+            pos_by_instru_save_dir=pos_by_instru_save_dir,
+            pos_fea_db_struct=pos_fea_db_struct,
+            top_ns=top_ns,
+            calendar=calendar,
+        )
+        perf_run.add(task_stats)
     return 0
@@ -1,12 +1,22 @@
 import multiprocessing as mp
+from typing import Callable
 import numpy as np
 import pandas as pd
 from loguru import logger
 from rich.progress import track, Progress
 from husfort.qutility import qtimer, SFG, SFY, error_handler, check_and_makedirs
-from husfort.qcalendar import CCalendar
 from husfort.qsqlite import CMgrSqlDb, CDbStruct
-from solutions.shared import load_fmd
+from solutions.shared import load_fmd, from_sql_dates, to_sql_dates
+from solutions.calendar_index import CCalendarIndex
+from solutions.dbpool import db_pool
+from solutions.perf import CTaskStats, CTaskTimer, CPerfRun
+from solutions.snapshot import load_state, save_state, make_state
+from solutions.admission import CMemEstimator, CMemScheduler, summarize_estimates
+from solutions.roll import CRollTable, make_roll_data
+from solutions.normalize import UNIT_COLS, adjust_units
+
+# memory per fmd row of a task, used before any history is recorded in perf ledger
+MEM_BYTES_PER_FMD_ROW = 2048
 
 
 def get_pre_price(instru_md_data: pd.DataFrame, price: str) -> pd.DataFrame:
@@ -30,83 +40,107 @@ def get_pre_price(instru_md_data: pd.DataFrame, price: str) -> pd.DataFrame:
 
 
 def load_basis(db_struct: CDbStruct, instrument: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
-    sqldb = CMgrSqlDb(
-        db_save_dir=db_struct.db_save_dir,
-        db_name=db_struct.db_name,
-        table=db_struct.table,
-        mode="r",
+    raw_data = db_pool.read_range(
+        db_struct, bgn_date, stp_date,
+        conditions=[("ts_code", instrument)],
+        value_columns=["trade_date", "basis", "basis_rate", "basis_annual"],
     )
-    raw_data = sqldb.read_by_conditions(conditions=[
-        ("trade_date", ">=", bgn_date),
-        ("trade_date", "<", stp_date),
-        ("ts_code", "=", instrument),
-    ])
-    return raw_data[["trade_date", "basis", "basis_rate", "basis_annual"]]
+    return from_sql_dates(raw_data)
 
 
 def load_stock(db_struct: CDbStruct, instrument: str, bgn_date: str, stp_date: str) -> pd.DataFrame:
-    sqldb = CMgrSqlDb(
-        db_save_dir=db_struct.db_save_dir,
-        db_name=db_struct.db_name,
-        table=db_struct.table,
-        mode="r",
+    raw_data = db_pool.read_range(
+        db_struct, bgn_date, stp_date,
+        conditions=[("ts_code", instrument)],
+        value_columns=["trade_date", "stock"],
+    )
+    return from_sql_dates(raw_data)
+
+
+def get_fmd_sizes(db_struct_fmd: CDbStruct, bgn_date: str, stp_date: str) -> dict[str, int]:
+    """
+    return: {instrument: number of fmd rows in [bgn_date, stp_date)}
+
+    """
+    data = db_pool.query(
+        db_struct_fmd,
+        f"SELECT instrument, COUNT(*) AS n FROM {db_struct_fmd.table.name} "
+        f"WHERE trade_date >= ? AND trade_date < ? GROUP BY instrument",
+        [bgn_date, stp_date],
     )
-    raw_data = sqldb.read_by_conditions(conditions=[
-        ("trade_date", ">=", bgn_date),
-        ("trade_date", "<", stp_date),
-        ("ts_code", "=", instrument),
-    ])
-    return raw_data[["trade_date", "stock"]]
+    return dict(zip(data["instrument"], data["n"].astype(int)))
 
 
 def find_major_and_minor_by_instru(
-        instru: str, instru_all_data: pd.DataFrame, vol_alpha: float, slc_vars: list[str]
-) -> tuple[pd.DataFrame, pd.DataFrame]:
+        instru: str, instru_all_data: pd.DataFrame, vol_alphas: list[float], slc_vars: list[str]
+) -> dict[float, tuple[pd.DataFrame, pd.DataFrame]]:
     """
-    return: 2 pd.DataFrames with cols
-            first:  ["trade_date", "ticker"] + basic_inputs + major
-            second:  ["trade_date", "ticker"] + basic_inputs + major
+    For each date, major is the ticker with the largest oi_add_vol = (1 - vol_alpha) * oi + vol_alpha * vol,
+    ties broken by ticker. Minor is the largest of tickers after major, if there is none, it is
+    the largest of tickers before major, and then they are swapped to keep major ahead of minor.
+
+    All vol_alphas are ranked in one lexsort of (alpha, trade_date, -oi_add_vol, ticker).
+
+    return: {vol_alpha: (major_data, minor_data)}, both with cols = ["trade_date", "ticker"] + slc_vars
 
     """
 
-    def __reformat(raw_data: pd.DataFrame, reformat_vars: list[str]):
-        if raw_data.empty:
-            return pd.DataFrame(columns=reformat_vars)
-        else:
-            raw_data = raw_data.reset_index().rename(mapper={"index": "ticker"}, axis=1)
-            return raw_data[reformat_vars]
+    def __reformat(rows: np.ndarray, reformat_vars: list[str]) -> pd.DataFrame:
+        raw_data = instru_all_data.iloc[rows].reset_index(drop=True)
+        return raw_data[reformat_vars].astype({"trade_date": np.int32})
 
-    major_res, minor_res = [], []
-    if not instru_all_data.empty:
-        wgt = pd.Series({"oi": 1 - vol_alpha, "vol": vol_alpha})
-        instru_all_data["oi_add_vol"] = instru_all_data[["oi", "vol"]].fillna(0) @ wgt
-        instru_all_data = instru_all_data.sort_values(
-            by=["trade_date", "oi_add_vol", "ticker"],
-            ascending=[True, False, True],
-        ).set_index("ticker")
-        for trade_date, trade_date_instru_data in instru_all_data.groupby(by="trade_date"):
-            sv = trade_date_instru_data["oi_add_vol"]  # a pd.Series: sum of oi and vol, with contract_id as index
-            major_ticker = sv.idxmax()
-            minor_sv = sv[sv.index > major_ticker]
-            if not minor_sv.empty:
-                minor_ticker = minor_sv.idxmax()
-            else:
-                minor_sv = sv[sv.index < major_ticker]
-                if not minor_sv.empty:
-                    minor_ticker = minor_sv.idxmax()
-                    # always keep major_ticker is ahead of minor_ticker
-                    major_ticker, minor_ticker = minor_ticker, major_ticker
-                else:
-                    minor_ticker = major_ticker
-                    logger.warning(f"There is only one ticker for {SFY(instru)} at {SFG(trade_date)}")
-            s_major = trade_date_instru_data.loc[major_ticker]
-            s_minor = trade_date_instru_data.loc[minor_ticker]
-            major_res.append(s_major)
-            minor_res.append(s_minor)
-    major_data, minor_data = pd.DataFrame(major_res), pd.DataFrame(minor_res)
     rft_vars = ["trade_date", "ticker"] + slc_vars
-    major_data, minor_data = __reformat(major_data, rft_vars), __reformat(minor_data, rft_vars)
-    return major_data, minor_data
+    if instru_all_data.empty:
+        empty_data = pd.DataFrame(columns=rft_vars).astype({"trade_date": np.int32})
+        return {vol_alpha: (empty_data, empty_data) for vol_alpha in vol_alphas}
+
+    n, alphas = len(instru_all_data), np.array(vol_alphas, dtype=np.float64)
+    oi = instru_all_data["oi"].fillna(0).to_numpy(np.float64)
+    vol = instru_all_data["vol"].fillna(0).to_numpy(np.float64)
+    tickers, _ = pd.factorize(instru_all_data["ticker"], sort=True)
+    oi_add_vol = (np.outer(1 - alphas, oi) + np.outer(alphas, vol)).ravel()
+    alpha_idx = np.repeat(np.arange(len(alphas)), n)
+    rows = np.tile(np.arange(n), len(alphas))
+    dates = np.tile(instru_all_data["trade_date"].to_numpy(np.int32), len(alphas))
+    tickers = np.tile(tickers, len(alphas))
+
+    order = np.lexsort((tickers, -oi_add_vol, dates, alpha_idx))
+    alpha_idx, rows, dates, tickers = alpha_idx[order], rows[order], dates[order], tickers[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (alpha_idx[1:] != alpha_idx[:-1]) | (dates[1:] != dates[:-1])
+    group_id = np.cumsum(new_group) - 1
+    first_pos = np.flatnonzero(new_group)
+    major_tickers = tickers[first_pos][group_id]
+
+    def __first_of_groups(mask: np.ndarray) -> np.ndarray:
+        """
+        return: position of the first element where mask is True in each group, -1 if none
+
+        """
+        res = np.full(len(first_pos), -1)
+        pos = np.flatnonzero(mask)
+        groups, first_idx = np.unique(group_id[pos], return_index=True)
+        res[groups] = pos[first_idx]
+        return res
+
+    gt_pos = __first_of_groups(tickers > major_tickers)
+    lt_pos = __first_of_groups(tickers < major_tickers)
+    major_pos, minor_pos = first_pos.copy(), gt_pos.copy()
+    swap = (gt_pos < 0) & (lt_pos >= 0)
+    major_pos[swap], minor_pos[swap] = lt_pos[swap], first_pos[swap]
+    single = (gt_pos < 0) & (lt_pos < 0)
+    minor_pos[single] = first_pos[single]
+    for trade_date in dates[first_pos[single & (alpha_idx[first_pos] == 0)]]:
+        logger.warning(f"There is only one ticker for {SFY(instru)} at {SFG(trade_date)}")
+
+    res = {}
+    group_alpha = alpha_idx[first_pos]
+    for k, vol_alpha in enumerate(vol_alphas):
+        slc = group_alpha == k
+        major_data = __reformat(rows[major_pos[slc]], rft_vars)
+        minor_data = __reformat(rows[minor_pos[slc]], rft_vars)
+        res[vol_alpha] = (major_data, minor_data)
+    return res
 
 
 def add_pre_price(instru_data: pd.DataFrame, pre_price_data: pd.DataFrame) -> pd.DataFrame:
@@ -137,7 +171,7 @@ def sum_vol_amount_oi_by_instru(instru_all_data: pd.DataFrame) -> pd.DataFrame:
         sum_df = sum_df.reset_index()
         return sum_df[save_cols]
     else:
-        return pd.DataFrame(columns=save_cols)
+        return pd.DataFrame(columns=save_cols).astype({"trade_date": np.int32})
 
 
 def merge_all(
@@ -173,39 +207,15 @@ def cal_instru_idx(instru_data: pd.DataFrame, init_close_val: float):
     return 0
 
 
-def make_double_to_single(
-        instru_data: pd.DataFrame,
-        adj_cols: list[str],
-        adj_date: str,
-        instru: str,
-        exempt_instruments: list[str],
-):
-    if instru in exempt_instruments:
-        adj_ratio = 1
-    else:
-        adj_ratio = [2 if t < adj_date else 1 for t in instru_data["trade_date"]]
-    instru_data[adj_cols] = instru_data[adj_cols].div(adj_ratio, axis="index").fillna(0)
-    return 0
-
-
 def adjust_vol_amt_oi(merged_data: pd.DataFrame, instru: str):
-    _vol_adj_date: str = "20200101"
-    _exempt_instruments = ["IH", "IF", "IC", "IM", "TF", "TS", "T", "TL"]
-
     # adjust volume, amount and oi cols
-    _vol_cols = ["vol", "amount", "oi"]
-    maj_cols = [f"{z}_major" for z in _vol_cols]
-    min_cols = [f"{z}_minor" for z in _vol_cols]
-    vol_cols = [f"{z}_instru" for z in _vol_cols]
+    maj_cols = [f"{z}_major" for z in UNIT_COLS]
+    min_cols = [f"{z}_minor" for z in UNIT_COLS]
+    vol_cols = [f"{z}_instru" for z in UNIT_COLS]
     adj_cols = maj_cols + min_cols + vol_cols
-    merged_data.rename(mapper={_z: z for _z, z in zip(_vol_cols, vol_cols)}, axis=1, inplace=True)
-    make_double_to_single(
-        instru_data=merged_data,
-        adj_cols=adj_cols,
-        adj_date=_vol_adj_date,
-        instru=instru,
-        exempt_instruments=_exempt_instruments,
-    )
+    merged_data.rename(mapper={_z: z for _z, z in zip(UNIT_COLS, vol_cols)}, axis=1, inplace=True)
+    adjust_units(merged_data, instru, cols=adj_cols, trade_dates=merged_data["trade_date"].to_numpy())
+    merged_data[adj_cols] = merged_data[adj_cols].fillna(0)
     return 0
 
 
@@ -213,65 +223,126 @@ def select(merged_data: pd.DataFrame, output_vars: list[str]) -> pd.DataFrame:
     return merged_data[output_vars]
 
 
+def get_db_struct_by_alpha(db_struct_preprocess: CDbStruct, vol_alphas: list[float]) -> dict[float, CDbStruct]:
+    """
+    return: {vol_alpha: db_struct}, the first vol_alpha is saved to db_struct_preprocess,
+            the others to sibling directories, such as preprocess_alpha0.8
+
+    """
+    res = {vol_alphas[0]: db_struct_preprocess}
+    for vol_alpha in vol_alphas[1:]:
+        alpha_save_dir = f"{db_struct_preprocess.db_save_dir}_alpha{vol_alpha:g}"
+        res[vol_alpha] = db_struct_preprocess.copy_to_another(alpha_save_dir)
+    return res
+
+
 def process_for_instru(
         instru: str,
         bgn_date: str,
         stp_date: str,
-        vol_alpha: float,
+        vol_alphas: list[float],
         slc_vars: list[str],
         db_struct_fmd: CDbStruct,
         db_struct_basis: CDbStruct,
         db_struct_stock: CDbStruct,
         db_struct_preprocess: CDbStruct,
-        calendar: CCalendar,
-):
-    dates_header = calendar.get_dates_header(bgn_date, stp_date)
-
-    # load
-    base_bgn_date = calendar.get_next_date(bgn_date, -1)
-    instru_all_data = load_fmd(db_struct_fmd, instru, base_bgn_date, stp_date)
-    instru_basis_data = load_basis(db_struct_basis, instru, bgn_date, stp_date)
-    instru_stock_data = load_stock(db_struct_stock, instru, bgn_date, stp_date)
-
-    # to sql
-    check_and_makedirs(db_struct_preprocess.db_save_dir)
-    db_struct_instru = db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
-    sqldb = CMgrSqlDb(
-        db_save_dir=db_struct_instru.db_save_dir,
-        db_name=db_struct_instru.db_name,
-        table=db_struct_instru.table,
-        mode="a",
-    )
-    if sqldb.check_continuity(bgn_date, calendar) == 0:
-        instru_pre_opn_data = get_pre_price(instru_all_data, price="open")
-        instru_pre_cls_data = get_pre_price(instru_all_data, price="close")
-        instru_maj_data, instru_min_data = find_major_and_minor_by_instru(
+        calendar: CCalendarIndex,
+        fence: Callable[[], None] | None = None,
+) -> tuple[CTaskStats, pd.DataFrame]:
+    """
+    params: vol_alphas: source data are loaded and pre-priced once, then major and minor are
+            selected for each vol_alpha, see get_db_struct_by_alpha for where they are saved
+    params: fence: called right before each write to preprocess dbs, given by queue workers,
+            see solutions.workqueue
+
+    return: task stats, and roll data of vol_alphas[0] written in this task, which is saved
+            to roll table by the main process, see solutions.roll
+
+    """
+    roll_data = pd.DataFrame()
+    with CTaskTimer(instru) as task:
+        dates_header = calendar.get_keys_header(bgn_date, stp_date)
+        base_bgn_date = calendar.get_next_date(bgn_date, -1)
+
+        # to sql, alphas whose db is not continuous with bgn_date are skipped
+        sqldbs, states = {}, {}
+        for vol_alpha, db_struct_alpha in get_db_struct_by_alpha(db_struct_preprocess, vol_alphas).items():
+            check_and_makedirs(db_struct_alpha.db_save_dir)
+            db_struct_instru = db_struct_alpha.copy_to_another(another_db_name=f"{instru}.db")
+            sqldb = CMgrSqlDb(
+                db_save_dir=db_struct_instru.db_save_dir,
+                db_name=db_struct_instru.db_name,
+                table=db_struct_instru.table,
+                mode="a",
+            )
+            if sqldb.check_continuity(bgn_date, calendar) == 0:
+                sqldbs[vol_alpha] = (db_struct_instru, sqldb)
+                states[vol_alpha] = load_state(db_struct_instru, sqldb, base_date=base_bgn_date)
+        if not sqldbs:
+            return task.stats, roll_data
+
+        # load
+        if any(state is None for state in states.values()):
+            instru_all_data = load_fmd(db_struct_fmd, instru, base_bgn_date, stp_date)
+            instru_pre_md_data = instru_all_data
+        else:
+            instru_all_data = load_fmd(db_struct_fmd, instru, bgn_date, stp_date)
+            state_md_data = next(iter(states.values())).to_md_data()  # prices are the same for all alphas
+            instru_pre_md_data = pd.concat([state_md_data, instru_all_data], axis=0, ignore_index=True)
+        instru_basis_data = load_basis(db_struct_basis, instru, bgn_date, stp_date)
+        instru_stock_data = load_stock(db_struct_stock, instru, bgn_date, stp_date)
+        task.stats.rows_read += len(instru_all_data) + len(instru_basis_data) + len(instru_stock_data)
+
+        instru_pre_opn_data = get_pre_price(instru_pre_md_data, price="open")
+        instru_pre_cls_data = get_pre_price(instru_pre_md_data, price="close")
+        instru_vol_data = sum_vol_amount_oi_by_instru(instru_all_data=instru_all_data)
+        major_and_minor = find_major_and_minor_by_instru(
             instru=instru,
             instru_all_data=instru_all_data,
             slc_vars=slc_vars,
-            vol_alpha=vol_alpha,
-        )
-        instru_maj_data = add_pre_price(instru_maj_data, instru_pre_opn_data)
-        instru_maj_data = add_pre_price(instru_maj_data, instru_pre_cls_data)
-        instru_min_data = add_pre_price(instru_min_data, instru_pre_opn_data)
-        instru_min_data = add_pre_price(instru_min_data, instru_pre_cls_data)
-        cal_return(instru_maj_data)
-        cal_return(instru_min_data)
-        instru_vol_data = sum_vol_amount_oi_by_instru(instru_all_data=instru_all_data)
-        merged_data = merge_all(
-            dates_header=dates_header,
-            instru_maj_data=instru_maj_data,
-            instru_min_data=instru_min_data,
-            instru_vol_data=instru_vol_data,
-            instru_basis_data=instru_basis_data,
-            instru_stock_data=instru_stock_data,
+            vol_alphas=list(sqldbs),
         )
-        init_close_val = get_init_close_val(sqldb=sqldb, instru_data=merged_data)
-        cal_instru_idx(instru_data=merged_data, init_close_val=init_close_val)
-        adjust_vol_amt_oi(merged_data=merged_data, instru=instru)
-        new_data = select(merged_data, output_vars=db_struct_instru.table.vars.names)
-        sqldb.update(update_data=new_data)
-    return 0
+        for vol_alpha, (instru_maj_data, instru_min_data) in major_and_minor.items():
+            db_struct_instru, sqldb = sqldbs[vol_alpha]
+            instru_maj_data = add_pre_price(instru_maj_data, instru_pre_opn_data)
+            instru_maj_data = add_pre_price(instru_maj_data, instru_pre_cls_data)
+            instru_min_data = add_pre_price(instru_min_data, instru_pre_opn_data)
+            instru_min_data = add_pre_price(instru_min_data, instru_pre_cls_data)
+            cal_return(instru_maj_data)
+            cal_return(instru_min_data)
+            merged_data = merge_all(
+                dates_header=dates_header,
+                instru_maj_data=instru_maj_data,
+                instru_min_data=instru_min_data,
+                instru_vol_data=instru_vol_data,
+                instru_basis_data=instru_basis_data,
+                instru_stock_data=instru_stock_data,
+            )
+            if (state := states[vol_alpha]) is None:
+                init_close_val = get_init_close_val(sqldb=sqldb, instru_data=merged_data)
+            else:
+                init_close_val = state.close_idx
+            cal_instru_idx(instru_data=merged_data, init_close_val=init_close_val)
+            adjust_vol_amt_oi(merged_data=merged_data, instru=instru)
+            new_data = select(merged_data, output_vars=db_struct_instru.table.vars.names)
+            if fence is not None:
+                fence()
+            sqldb.update(update_data=to_sql_dates(new_data))
+            task.stats.rows_written += len(new_data)
+            save_state(db_struct_instru, make_state(instru_all_data=instru_all_data, merged_data=merged_data))
+            if vol_alpha == vol_alphas[0]:
+                roll_data = make_roll_data(instru, merged_data)
+    return task.stats, roll_data
+
+
+def process_stats_for_instru(**kwargs) -> CTaskStats:
+    """
+    for queue workers, roll data is dropped, roll table catches up from preprocess dbs
+    in the next update, see CRollTable.update
+
+    """
+    task_stats, _ = process_for_instru(**kwargs)
+    return task_stats
 
 
 @qtimer
@@ -279,48 +350,72 @@ def main_preprocess(
         universe: list[str],
         bgn_date: str,
         stp_date: str,
-        vol_alpha: float,
+        vol_alphas: list[float],
         db_struct_fmd: CDbStruct,
         db_struct_basis: CDbStruct,
         db_struct_stock: CDbStruct,
         db_struct_preprocess: CDbStruct,
+        db_struct_roll: CDbStruct,
         slc_vars: list[str],
-        calendar: CCalendar,
+        calendar: CCalendarIndex,
         call_multiprocess: bool,
+        processes: int | None,
+        ram_budget: int,
+        perf_run: CPerfRun,
 ):
-    # header
+    """
+    params: vol_alphas: the first one is saved to db_struct_preprocess, others are
+            saved to their own directories, see get_db_struct_by_alpha
+    params: ram_budget: bytes, tasks are admitted to the pool only while their
+            estimated memory in total stays under it, see solutions.admission
+
+    """
+    rolls: list[pd.DataFrame] = []
     if call_multiprocess:
+        processes = processes or mp.cpu_count()
+        fmd_sizes = get_fmd_sizes(db_struct_fmd, calendar.get_next_date(bgn_date, -1), stp_date)
+        estimator = CMemEstimator(perf_run.ledger_path, "preprocess", default_bytes_per_unit=MEM_BYTES_PER_FMD_ROW)
+        tasks = []
+        for instru in universe:
+            kwds = {
+                "instru": instru,
+                "bgn_date": bgn_date,
+                "stp_date": stp_date,
+                "vol_alphas": vol_alphas,
+                "slc_vars": slc_vars,
+                "db_struct_fmd": db_struct_fmd,
+                "db_struct_basis": db_struct_basis,
+                "db_struct_stock": db_struct_stock,
+                "db_struct_preprocess": db_struct_preprocess,
+                "calendar": calendar,
+            }
+            src_size = fmd_sizes.get(instru, 0) * len(vol_alphas)
+            tasks.append((instru, kwds, src_size, estimator.estimate(instru, src_size)))
+        summarize_estimates("preprocess", tasks)
+
         with Progress() as pb:
             main_task = pb.add_task(description=f"Preprocessing {bgn_date}->{stp_date}", total=len(universe))
-            with mp.get_context("spawn").Pool() as pool:
-                for instru in universe:
-                    pool.apply_async(
-                        process_for_instru,
-                        kwds={
-                            "instru": instru,
-                            "bgn_date": bgn_date,
-                            "stp_date": stp_date,
-                            "vol_alpha": vol_alpha,
-                            "slc_vars": slc_vars,
-                            "db_struct_fmd": db_struct_fmd,
-                            "db_struct_basis": db_struct_basis,
-                            "db_struct_stock": db_struct_stock,
-                            "db_struct_preprocess": db_struct_preprocess,
-                            "calendar": calendar,
-                        },
-                        callback=lambda _: pb.update(main_task, advance=1),
-                        error_callback=error_handler,
-                    )
+
+            def __callback(res: tuple[CTaskStats, pd.DataFrame], src_size: int):
+                task_stats, roll_data = res
+                task_stats.src_size = src_size
+                perf_run.add(task_stats)
+                rolls.append(roll_data)
+                pb.update(main_task, advance=1)
+
+            with mp.get_context("spawn").Pool(processes) as pool:
+                scheduler = CMemScheduler(budget=ram_budget, processes=processes)
+                scheduler.run(pool, process_for_instru, tasks, callback=__callback, error_callback=error_handler)
                 pool.close()
                 pool.join()
     else:
         for instru in track(universe, description=f"Preprocessing {bgn_date}->{stp_date}"):
             # for instru in universe:
-            process_for_instru(
+            task_stats, roll_data = process_for_instru(
                 instru=instru,
                 bgn_date=bgn_date,
                 stp_date=stp_date,
-                vol_alpha=vol_alpha,
+                vol_alphas=vol_alphas,
                 slc_vars=slc_vars,
                 db_struct_fmd=db_struct_fmd,
                 db_struct_basis=db_struct_basis,
@@ -328,4 +423,8 @@ def main_preprocess(
                 db_struct_preprocess=db_struct_preprocess,
                 calendar=calendar,
             )
+            perf_run.add(task_stats)
+            rolls.append(roll_data)
+    rows = CRollTable(db_struct_roll, db_struct_preprocess).update(universe, rolls, calendar)
+    logger.info(f"{SFG(rows)} rows written to roll table")
     return 0
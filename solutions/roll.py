@@ -0,0 +1,187 @@
+import os
+import sqlite3
+from contextlib import closing
+import pandas as pd
+from loguru import logger
+from husfort.qutility import SFG, SFY, check_and_makedirs
+from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from solutions.dbpool import db_pool
+from solutions.calendar_index import CCalendarIndex
+from solutions.shared import from_sql_dates, to_sql_dates
+
+ROLL_COLUMNS = ["trade_date", "instrument", "ticker_major", "ticker_minor"]
+
+# (first date, last date, number of rows)
+TSpan = tuple[str, str, int]
+
+
+def make_roll_data(instru: str, merged_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    params: merged_data: output of preprocess, with columns = ["trade_date", "ticker_major", "ticker_minor"] at least
+
+    return: a pd.DataFrame with columns = ROLL_COLUMNS, trade_date is int32 key
+
+    """
+    roll_data = merged_data[["trade_date", "ticker_major", "ticker_minor"]].assign(instrument=instru)
+    return roll_data[ROLL_COLUMNS]
+
+
+class CRollTable:
+    """
+    major and minor tickers of all instruments by date, in one db indexed by (trade_date, instrument).
+    It is maintained by preprocess, rows are written only by the main process.
+
+    The roll table of an instrument is valid only when its span, i.e. first date, last date
+    and number of rows, equals the span of the instrument's preprocess db, readers should fall
+    back to the preprocess db otherwise. Rows of an instrument are rebuilt when they do not
+    match its preprocess db, such as after the preprocess db is rebuilt from an earlier date.
+    """
+
+    def __init__(self, db_struct_roll: CDbStruct, db_struct_preprocess: CDbStruct):
+        self.db_struct_roll = db_struct_roll
+        self.db_struct_preprocess = db_struct_preprocess
+
+    def exists(self, db_struct: CDbStruct) -> bool:
+        return os.path.exists(os.path.join(db_struct.db_save_dir, db_struct.db_name))
+
+    def get_spans(self) -> dict[str, TSpan]:
+        """
+        return: {instrument: span in roll table}
+
+        """
+        if not self.exists(self.db_struct_roll):
+            return {}
+        data = db_pool.query(
+            self.db_struct_roll,
+            f"SELECT instrument, MIN(trade_date) AS bgn, MAX(trade_date) AS end, COUNT(*) AS n "
+            f"FROM {self.db_struct_roll.table.name} GROUP BY instrument",
+        )
+        return {instru: (bgn, end, int(n)) for instru, bgn, end, n in data.itertuples(index=False)}
+
+    def get_instru_span(self, instru: str, end_date: str = None) -> TSpan | None:
+        """
+        params: end_date: only rows with trade_date <= end_date are counted, all rows if None
+
+        return: span of the preprocess db of instru, None if it is empty
+
+        """
+        db_struct_instru = self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
+        if not self.exists(db_struct_instru):
+            return None
+        sql = f"SELECT MIN(trade_date) AS bgn, MAX(trade_date) AS end, COUNT(*) AS n FROM {db_struct_instru.table.name}"
+        data = db_pool.query(db_struct_instru, sql) if end_date is None else db_pool.query(
+            db_struct_instru, sql + " WHERE trade_date <= ?", [end_date]
+        )
+        bgn, end, n = data.iloc[0]
+        return None if n == 0 else (bgn, end, int(n))
+
+    def clear(self, instruments: list[str]) -> None:
+        """
+        delete rows of instruments from roll table
+
+        """
+        db_path = os.path.join(self.db_struct_roll.db_save_dir, self.db_struct_roll.db_name)
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.executemany(
+                f"DELETE FROM {self.db_struct_roll.table.name} WHERE instrument = ?", [(z,) for z in instruments]
+            )
+            conn.commit()
+        logger.info(f"Roll table of {SFY(instruments)} does not match their preprocess db, it is rebuilt")
+        return None
+
+    def save(self, new_data: pd.DataFrame) -> int:
+        check_and_makedirs(self.db_struct_roll.db_save_dir)
+        sqldb = CMgrSqlDb(
+            db_save_dir=self.db_struct_roll.db_save_dir,
+            db_name=self.db_struct_roll.db_name,
+            table=self.db_struct_roll.table,
+            mode="a",
+        )
+        sqldb.update(update_data=to_sql_dates(new_data[ROLL_COLUMNS]))
+        return len(new_data)
+
+    def update(self, universe: list[str], roll_data: list[pd.DataFrame], calendar: CCalendarIndex) -> int:
+        """
+        params: roll_data: rows returned by preprocess workers, used only if they continue the
+                roll table of their instrument, or they start from the first date of their
+                preprocess db, which is then built from scratch by the worker. Instruments still
+                behind their preprocess db after that, such as those updated by queue workers,
+                are caught up by reading their preprocess db.
+
+        return: number of rows written
+
+        """
+        spans = self.get_spans()
+        instru_spans = {z: self.get_instru_span(z) for z in universe}
+        # rows which do not match the preprocess db up to their last date
+        stale = [z for z, span in spans.items() if span != self.get_instru_span(z, end_date=span[1])]
+        # preprocess dbs built from scratch by workers, roll data holds all their rows
+        rebuilt = {
+            data["instrument"].iloc[0] for data in roll_data if (not data.empty) and
+            (instru_span := instru_spans.get(data["instrument"].iloc[0])) is not None and
+            instru_span[0] == str(data["trade_date"].min())
+        }
+        if stale := sorted(set(stale) | (rebuilt & set(spans))):
+            self.clear(stale)
+        watermarks = {z: span[1] for z, span in spans.items() if z not in stale}
+
+        new_data: list[pd.DataFrame] = []
+        for data in roll_data:
+            if data.empty:
+                continue
+            instru = data["instrument"].iloc[0]
+            if instru in rebuilt:
+                new_data.append(data)
+                watermarks[instru] = str(data["trade_date"].max())
+                continue
+            if (watermark := watermarks.get(instru)) is None:
+                continue
+            base_date = calendar.get_next_date(str(data["trade_date"].min()), -1)
+            if watermark < base_date:
+                continue
+            if not (data := data[data["trade_date"] > int(watermark)]).empty:
+                new_data.append(data)
+                watermarks[instru] = str(data["trade_date"].max())
+        for instru, instru_span in instru_spans.items():
+            if instru_span is None or watermarks.get(instru, "") >= instru_span[1]:
+                continue
+            db_struct_instru = self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db")
+            if instru in watermarks:
+                bgn_date = calendar.get_next_date(watermarks[instru], shift=1)
+            else:
+                bgn_date = instru_span[0]
+            data = db_pool.read_range(
+                db_struct_instru, bgn_date, calendar.get_next_date(instru_span[1], shift=1),
+                value_columns=["trade_date", "ticker_major", "ticker_minor"],
+            )
+            logger.info(f"Roll table of {SFY(instru)} is caught up from its preprocess db, {len(data)} rows")
+            new_data.append(from_sql_dates(data).assign(instrument=instru))
+        if not new_data:
+            return 0
+        return self.save(pd.concat(new_data, axis=0, ignore_index=True))
+
+    def load(self, universe: list[str], bgn_date: str, stp_date: str) -> dict[str, pd.DataFrame]:
+        """
+        return: {instrument: a pd.DataFrame with columns = ["trade_date", "ticker_major", "ticker_minor"]},
+                trade_date is int32 key. Instruments whose roll table does not match the span
+                of their preprocess db are not included.
+
+        """
+        spans = self.get_spans()
+        valid = {z for z in universe if spans.get(z) is not None and spans[z] == self.get_instru_span(z)}
+        if len(valid) < len(universe):
+            logger.info(
+                f"Roll table is not valid for {SFY(len(universe) - len(valid))} instruments, "
+                f"they would read their preprocess db"
+            )
+        if not valid:
+            return {}
+        data = from_sql_dates(db_pool.read_range(self.db_struct_roll, bgn_date, stp_date))
+        res = {
+            instru: instru_data[["trade_date", "ticker_major", "ticker_minor"]].reset_index(drop=True)
+            for instru, instru_data in data.groupby(by="instrument") if instru in valid
+        }
+        for instru in valid:
+            res.setdefault(instru, pd.DataFrame(columns=["trade_date", "ticker_major", "ticker_minor"]))
+        logger.info(f"Roll table loaded for {SFG(len(valid))} instruments from {bgn_date} to {stp_date}")
+        return res
@@ -0,0 +1,315 @@
+import os
+import time
+from loguru import logger
+from husfort.qutility import SFG, SFR, SFY, check_and_makedirs
+from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from solutions.calendar_index import CCalendarIndex
+from solutions.dbpool import db_pool
+from solutions.perf import CPerfRun
+from solutions.snapshot import get_watermark
+from solutions.alternative import main_macro, main_forex
+from solutions.position import process_position_for_instru
+from solutions.preprocess import process_for_instru
+from solutions.minute_bar import CMinuteBarInstru, process_minute_bar_for_instru, get_minute_data_path
+from solutions.roll import CRollTable
+
+
+def get_db_watermark(db_struct: CDbStruct) -> str | None:
+    sqldb = CMgrSqlDb(
+        db_save_dir=db_struct.db_save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="a",
+    )
+    return get_watermark(sqldb)
+
+
+class CServe:
+    """
+    Long-running ingestion. Calendar, source db connections, instrument states and
+    the watermarks of all output dbs are kept in this process. Every poll it checks
+    the last dates of the source dbs and the minute bar files in daily_data_root_dir,
+    then runs only the stages and instruments which are behind, from their own watermarks.
+
+    Output dbs must be initialized by batch runs first, instruments with empty dbs are skipped.
+    Macro and forex are updated only after their source files are modified since serve started,
+    otherwise the last values would be copied forward as new dates.
+    """
+
+    def __init__(
+            self,
+            universe: list[str],
+            calendar: CCalendarIndex,
+            path_macro_data: str,
+            path_forex_data: str,
+            db_struct_macro: CDbStruct,
+            db_struct_forex: CDbStruct,
+            db_struct_position: CDbStruct,
+            db_struct_position_feature: CDbStruct,
+            pos_by_instru_save_dir: str,
+            pos_fea_top_ns: tuple[int, ...],
+            db_struct_fmd: CDbStruct,
+            db_struct_basis: CDbStruct,
+            db_struct_stock: CDbStruct,
+            db_struct_preprocess: CDbStruct,
+            db_struct_roll: CDbStruct,
+            vol_alpha: float,
+            slc_vars: list[str],
+            src_data_root_dir: str,
+            src_data_file_name_tmpl: str,
+            db_struct_minute_bar: CDbStruct,
+            perf_ledger_path: str,
+            settle_seconds: float = 30,
+    ):
+        """
+        params: settle_seconds: a minute bar file is ready only if it has not been modified for this long
+
+        """
+        self.universe = universe
+        self.calendar = calendar
+        self.path_macro_data = path_macro_data
+        self.path_forex_data = path_forex_data
+        self.db_struct_macro = db_struct_macro
+        self.db_struct_forex = db_struct_forex
+        self.db_struct_position = db_struct_position
+        self.db_struct_position_feature = db_struct_position_feature
+        self.pos_by_instru_save_dir = pos_by_instru_save_dir
+        self.pos_fea_top_ns = pos_fea_top_ns
+        self.db_struct_fmd = db_struct_fmd
+        self.db_struct_basis = db_struct_basis
+        self.db_struct_stock = db_struct_stock
+        self.db_struct_preprocess = db_struct_preprocess
+        self.roll_table = CRollTable(db_struct_roll, db_struct_preprocess)
+        self.vol_alpha = vol_alpha
+        self.slc_vars = slc_vars
+        self.src_data_root_dir = src_data_root_dir
+        self.src_data_file_name_tmpl = src_data_file_name_tmpl
+        self.db_struct_minute_bar = db_struct_minute_bar
+        self.perf_ledger_path = perf_ledger_path
+        self.settle_seconds = settle_seconds
+
+        self.watermarks: dict[str, dict[str, str | None]] = {}
+        self.alt_mtimes: dict[str, float] = {}
+        self.minute_ready_dates: set[str] = set()
+
+    def get_position_watermark(self, instru: str) -> str | None:
+        return get_db_watermark(
+            self.db_struct_position.copy_to_another(self.pos_by_instru_save_dir, another_db_name=f"{instru}.db")
+        )
+
+    def get_preprocess_watermark(self, instru: str) -> str | None:
+        return get_db_watermark(self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"))
+
+    def get_minute_bar_watermark(self, instru: str) -> str | None:
+        """
+        return: the last date processed, from its checkpoint if valid, which is later than
+                the watermark of its db if the last days have no minute data
+
+        """
+        minute_bar_instru = CMinuteBarInstru(
+            instrument=instru,
+            src_data_root_dir=self.src_data_root_dir,
+            src_data_file_name_tmpl=self.src_data_file_name_tmpl,
+            preprocess_db_struct=self.db_struct_preprocess.copy_to_another(another_db_name=f"{instru}.db"),
+            dst_db_struct=self.db_struct_minute_bar.copy_to_another(another_db_name=f"{instru}.db"),
+        )
+        return minute_bar_instru.load_checkpoint() or get_db_watermark(minute_bar_instru.dst_db_struct)
+
+    def init_watermarks(self) -> None:
+        # source files seen at startup are assumed to be ingested by batch runs
+        self.alt_mtimes = {
+            "macro": os.path.getmtime(self.path_macro_data),
+            "forex": os.path.getmtime(self.path_forex_data),
+        }
+        self.watermarks["macro"] = {"macro": get_db_watermark(self.db_struct_macro)}
+        self.watermarks["forex"] = {"forex": get_db_watermark(self.db_struct_forex)}
+        self.watermarks["position"], self.watermarks["preprocess"], self.watermarks["minute_bar"] = {}, {}, {}
+        for instru in self.universe:
+            self.watermarks["position"][instru] = self.get_position_watermark(instru)
+            self.watermarks["preprocess"][instru] = self.get_preprocess_watermark(instru)
+            self.watermarks["minute_bar"][instru] = self.get_minute_bar_watermark(instru)
+        for stage, stage_watermarks in self.watermarks.items():
+            if empty := [k for k, v in stage_watermarks.items() if v is None]:
+                logger.warning(f"Output dbs of {SFR(stage)} are empty and skipped in serve mode: {empty}")
+        return None
+
+    def get_behind(self, stage: str, src_last_date: str) -> dict[str, str]:
+        """
+        return: {key: first date to update} for keys of stage whose watermark is behind src_last_date
+
+        """
+        return {
+            k: self.calendar.get_next_date(wm, shift=1)
+            for k, wm in self.watermarks[stage].items() if (wm is not None) and (wm < src_last_date)
+        }
+
+    def update_alternative(self, fmd_last_date: str) -> int:
+        n = 0
+        stp_date = self.calendar.get_next_date(fmd_last_date, shift=1)
+        for stage, main_func, path_data, db_struct in [
+            ("macro", main_macro, self.path_macro_data, self.db_struct_macro),
+            ("forex", main_forex, self.path_forex_data, self.db_struct_forex),
+        ]:
+            mtime = os.path.getmtime(path_data)
+            if (bgn_date := self.get_behind(stage, fmd_last_date).get(stage)) is None:
+                continue
+            if self.alt_mtimes.get(stage) == mtime:
+                continue  # wait for the source file to be updated
+            with CPerfRun(f"serve-{stage}", bgn_date, stp_date, ledger_path=self.perf_ledger_path) as perf_run:
+                main_func(bgn_date, stp_date, path_data, db_struct, self.calendar, perf_run)
+            self.watermarks[stage][stage] = get_db_watermark(db_struct)
+            self.alt_mtimes[stage] = mtime
+            n += 1
+        return n
+
+    def update_position(self, pos_last_date: str) -> int:
+        behind = self.get_behind("position", pos_last_date)
+        if not behind:
+            return 0
+        stp_date = self.calendar.get_next_date(pos_last_date, shift=1)
+        with CPerfRun("serve-position", min(behind.values()), stp_date, self.perf_ledger_path) as perf_run:
+            for instru, bgn_date in behind.items():
+                try:
+                    perf_run.add(process_position_for_instru(
+                        instru=instru,
+                        bgn_date=bgn_date,
+                        stp_date=stp_date,
+                        pos_db_struct=self.db_struct_position,
+                        pos_by_instru_save_dir=self.pos_by_instru_save_dir,
+                        pos_fea_db_struct=self.db_struct_position_feature,
+                        top_ns=self.pos_fea_top_ns,
+                        calendar=self.calendar,
+                    ))
+                except Exception as e:
+                    logger.error(f"Failed to update {SFR('position')} of {SFR(instru)}: {e}")
+                else:
+                    # the write is skipped if it is not continuous with the db, so read it back
+                    self.watermarks["position"][instru] = self.get_position_watermark(instru)
+        return len(perf_run.tasks)
+
+    def update_preprocess(self, src_last_date: str) -> int:
+        """
+        params: src_last_date: the earliest of the last dates of fmd, basis and stock dbs,
+                so preprocess does not run before all its sources have a date
+
+        """
+        behind = self.get_behind("preprocess", src_last_date)
+        if not behind:
+            return 0
+        stp_date = self.calendar.get_next_date(src_last_date, shift=1)
+        affected = db_pool.query(
+            self.db_struct_fmd,
+            f"SELECT DISTINCT instrument FROM {self.db_struct_fmd.table.name} WHERE trade_date >= ?",
+            [min(behind.values())],
+        )["instrument"]
+        rolls = []
+        with CPerfRun("serve-preprocess", min(behind.values()), stp_date, self.perf_ledger_path) as perf_run:
+            for instru in [z for z in behind if z in set(affected)]:
+                try:
+                    task_stats, roll_data = process_for_instru(
+                        instru=instru,
+                        bgn_date=behind[instru],
+                        stp_date=stp_date,
+                        vol_alphas=[self.vol_alpha],
+                        slc_vars=self.slc_vars,
+                        db_struct_fmd=self.db_struct_fmd,
+                        db_struct_basis=self.db_struct_basis,
+                        db_struct_stock=self.db_struct_stock,
+                        db_struct_preprocess=self.db_struct_preprocess,
+                        calendar=self.calendar,
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to update {SFR('preprocess')} of {SFR(instru)}: {e}")
+                else:
+                    perf_run.add(task_stats)
+                    rolls.append(roll_data)
+                    self.watermarks["preprocess"][instru] = self.get_preprocess_watermark(instru)
+            self.roll_table.update(self.universe, rolls, self.calendar)
+        return len(perf_run.tasks)
+
+    def is_minute_data_ready(self, trade_date: str) -> bool:
+        if trade_date in self.minute_ready_dates:
+            return True
+        src_path = get_minute_data_path(self.src_data_root_dir, self.src_data_file_name_tmpl, trade_date)
+        if os.path.exists(src_path) and (time.time() - os.path.getmtime(src_path) > self.settle_seconds):
+            self.minute_ready_dates.add(trade_date)
+            return True
+        return False
+
+    def update_minute_bar(self) -> int:
+        tasks: dict[str, tuple[str, str]] = {}
+        for instru, wm in self.watermarks["minute_bar"].items():
+            pre_wm = self.watermarks["preprocess"][instru]
+            if (wm is None) or (pre_wm is None) or (wm >= pre_wm):
+                continue
+            bgn_date, ready_dates = self.calendar.get_next_date(wm, shift=1), []
+            for trade_date in self.calendar.get_iter_list(bgn_date, self.calendar.get_next_date(pre_wm, shift=1)):
+                if not self.is_minute_data_ready(trade_date):
+                    break
+                ready_dates.append(trade_date)
+            if ready_dates:
+                tasks[instru] = (ready_dates[0], ready_dates[-1])
+        if not tasks:
+            return 0
+        bgn_date = min(b for b, _ in tasks.values())
+        stp_date = self.calendar.get_next_date(max(e for _, e in tasks.values()), shift=1)
+        rolls = self.roll_table.load(list(tasks), bgn_date, stp_date)
+        with CPerfRun("serve-minute_bar", bgn_date, stp_date, self.perf_ledger_path) as perf_run:
+            for instru, (bgn_date, end_date) in tasks.items():
+                try:
+                    perf_run.add(process_minute_bar_for_instru(
+                        instru=instru,
+                        bgn_date=bgn_date,
+                        stp_date=self.calendar.get_next_date(end_date, shift=1),
+                        src_data_root_dir=self.src_data_root_dir,
+                        src_data_file_name_tmpl=self.src_data_file_name_tmpl,
+                        db_struct_preprocess=self.db_struct_preprocess,
+                        db_struct_minute_bar=self.db_struct_minute_bar,
+                        calendar=self.calendar,
+                        roll_data=rolls.get(instru),
+                    ))
+                except Exception as e:
+                    logger.error(f"Failed to update {SFR('minute bar')} of {SFR(instru)}: {e}")
+                else:
+                    self.watermarks["minute_bar"][instru] = self.get_minute_bar_watermark(instru)
+        return len(perf_run.tasks)
+
+    def step(self) -> int:
+        """
+        return: number of tasks run in this poll
+
+        """
+        n = 0
+        if (fmd_last_date := db_pool.last_date(self.db_struct_fmd)) is not None:
+            n += self.update_alternative(fmd_last_date)
+            src_last_dates = [
+                fmd_last_date,
+                db_pool.last_date(self.db_struct_basis),
+                db_pool.last_date(self.db_struct_stock),
+            ]
+            if None not in src_last_dates:
+                n += self.update_preprocess(min(src_last_dates))
+        if (pos_last_date := db_pool.last_date(self.db_struct_position)) is not None:
+            n += self.update_position(pos_last_date)
+        n += self.update_minute_bar()
+        return n
+
+    def main(self, interval: float) -> None:
+        check_and_makedirs(self.db_struct_position_feature.db_save_dir)
+        check_and_makedirs(self.db_struct_minute_bar.db_save_dir)
+        self.init_watermarks()
+        logger.info(f"Serving, polling every {SFY(interval)} seconds, press Ctrl+C to stop")
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    if (n := self.step()) > 0:
+                        logger.info(f"{SFG(n)} tasks updated in {SFG(f'{time.perf_counter() - t0:.2f}')} seconds")
+                except Exception as e:
+                    logger.error(f"Serve step failed: {e}")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Serving stopped")
+        finally:
+            db_pool.close()
+        return None
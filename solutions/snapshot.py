@@ -0,0 +1,110 @@
+import os
+import json
+from dataclasses import dataclass, asdict
+import numpy as np
+import pandas as pd
+from loguru import logger
+from husfort.qutility import SFG, SFY
+from husfort.qsqlite import CDbStruct, CMgrSqlDb
+from solutions.shared import date_key
+
+
+@dataclass
+class CInstruState:
+    """
+    end-of-day state of an instrument after a preprocess run
+
+    trade_date: last date written to the preprocess db, must equal its watermark
+    prices: {ticker: [open, close]} of every ticker traded at trade_date
+    close_idx: last closeI
+    """
+    trade_date: str
+    prices: dict[str, list[float]]
+    close_idx: float
+    ticker_major: str | None
+    ticker_minor: str | None
+
+    def to_md_data(self) -> pd.DataFrame:
+        """
+        return: a pd.DataFrame with columns = ["trade_date", "ticker", "open", "close"],
+                which could be concatenated ahead of fmd data to calculate pre price
+
+        """
+        md_data = pd.DataFrame(
+            data=[(date_key(self.trade_date), ticker, opn, cls) for ticker, (opn, cls) in self.prices.items()],
+            columns=["trade_date", "ticker", "open", "close"],
+        )
+        return md_data.astype({"trade_date": np.int32})
+
+
+# states saved or loaded in this process, so a long-running process does not reread them
+_state_cache: dict[str, CInstruState] = {}
+
+
+def get_state_path(db_struct: CDbStruct) -> str:
+    state_file = os.path.splitext(db_struct.db_name)[0] + ".state.json"
+    return os.path.join(db_struct.db_save_dir, state_file)
+
+
+def get_watermark(sqldb: CMgrSqlDb) -> str | None:
+    tail_data = sqldb.tail(n=1, value_columns=["trade_date"])
+    return None if tail_data.empty else tail_data["trade_date"].iloc[-1]
+
+
+def load_state(db_struct: CDbStruct, sqldb: CMgrSqlDb, base_date: str) -> CInstruState | None:
+    """
+    params: base_date: the trading day before the begin date of this run
+
+    return: the snapshot if it matches both the watermark of sqldb and base_date,
+            else None, which means the snapshot is stale and must be rebuilt from source data
+
+    """
+    state_path = get_state_path(db_struct)
+    if (state := _state_cache.get(state_path)) is None:
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, "r") as f:
+            state = _state_cache[state_path] = CInstruState(**json.load(f))
+    watermark = get_watermark(sqldb)
+    if state.trade_date == watermark == base_date:
+        return state
+    logger.info(
+        f"State of {SFY(db_struct.db_name)} at {SFY(state.trade_date)} is stale, "
+        f"watermark = {SFG(watermark)}, base date = {SFG(base_date)}, it would be rebuilt"
+    )
+    return None
+
+
+def save_state(db_struct: CDbStruct, state: CInstruState) -> None:
+    state_path = get_state_path(db_struct)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(asdict(state), f)
+    os.replace(tmp_path, state_path)
+    _state_cache[state_path] = state
+
+
+def make_state(instru_all_data: pd.DataFrame, merged_data: pd.DataFrame) -> CInstruState:
+    """
+    trade_date in both data are int32 keys, see solutions.shared
+
+    params: instru_all_data: fmd data of this run, with columns = ["trade_date", "ticker", "open", "close"] at least
+    params: merged_data: data of this run which is written to db, with columns =
+            ["trade_date", "ticker_major", "ticker_minor", "closeI"] at least
+
+    """
+
+    def __to_ticker(z) -> str | None:
+        return z if isinstance(z, str) else None
+
+    last_row = merged_data.iloc[-1]
+    trade_date_key = int(merged_data["trade_date"].iloc[-1])
+    last_md_data = instru_all_data.loc[instru_all_data["trade_date"] == trade_date_key, ["ticker", "open", "close"]]
+    last_prices = last_md_data.groupby(by="ticker")[["open", "close"]].mean()
+    return CInstruState(
+        trade_date=str(trade_date_key),
+        prices={ticker: [float(opn), float(cls)] for ticker, (opn, cls) in last_prices.iterrows()},
+        close_idx=float(last_row["closeI"]),
+        ticker_major=__to_ticker(last_row["ticker_major"]),
+        ticker_minor=__to_ticker(last_row["ticker_minor"]),
+    )
@@ -0,0 +1,304 @@
+"""
+A work queue for sharded execution on several nodes.
+
+The coordinator splits instrument x date range into work units and submits them
+to a SQLite queue placed in a directory that all nodes can see. Workers on any node
+claim one unit at a time with a lease, renew it by heartbeat while working, and
+mark it done when finished. Leases not renewed in time (the worker died) are put
+back to pending.
+
+A unit could be claimed only if
+1. no other unit of the same stage and instrument is leased, so each output db has one writer;
+2. all earlier units of the same stage and instrument are done, to keep dates continuous;
+3. all units of the stages it depends on, for the same instrument, before its stop date are done.
+
+Lease expiry is compared with the wall clock of each node, so clocks of all nodes must be
+synchronized, by NTP for example. A lease is requeued only after it has expired for
+LEASE_SKEW_MARGIN seconds more, which tolerates clock differences less than that.
+
+A lost lease must not be followed by more writes, otherwise two workers could write the same
+db. Handlers are given a fence, which renews the lease and raises if it is lost. They call it
+right before each write to an output db, so a write starts with at least lease_seconds left.
+
+SQLite locking relies on the file system, on network shares make sure it supports
+byte-range locks, or keep the queue on a local disk and run all workers on that node.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import multiprocessing as mp
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Callable
+from loguru import logger
+from husfort.qutility import SFG, SFR, SFY, check_and_makedirs, error_handler
+from husfort.qcalendar import CCalendar
+from solutions.perf import CTaskStats, CPerfRun
+
+
+@dataclass(frozen=True)
+class CWorkUnit:
+    unit_id: str
+    stage: str
+    instrument: str
+    bgn_date: str
+    stp_date: str
+
+
+TUnitHandler = Callable[..., CTaskStats]
+TFence = Callable[[], None]
+
+# seconds a lease must have expired before it is requeued, to tolerate clock differences between nodes
+LEASE_SKEW_MARGIN = 60
+
+
+class CWorkQueue:
+    def __init__(self, queue_path: str, lease_seconds: float, max_attempts: int = 3):
+        self.queue_path = queue_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.queue_path, timeout=60, isolation_level=None)
+
+    def init(self) -> None:
+        check_and_makedirs(os.path.dirname(self.queue_path))
+        with closing(self.__connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS units (
+                    unit_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    instrument TEXT NOT NULL,
+                    bgn_date TEXT NOT NULL,
+                    stp_date TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    deps TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expiry REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_units_instru ON units (instrument, stage, bgn_date)")
+        return None
+
+    def submit(
+            self, universe: list[str], stages: list[str], deps: dict[str, list[str]],
+            bgn_date: str, stp_date: str, chunk: int, calendar: CCalendar,
+    ) -> int:
+        """
+        params: stages: stages to run, in the order they should be run for the same dates
+        params: deps: {stage: [stages it depends on]}
+        params: chunk: number of trading days in each unit
+
+        return: number of new units, units already in queue are ignored
+
+        """
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        date_ranges = []
+        for i in range(0, len(iter_dates), chunk):
+            chunk_dates = iter_dates[i:i + chunk]
+            date_ranges.append((chunk_dates[0], calendar.get_next_date(chunk_dates[-1], shift=1)))
+        rows = [
+            (f"{stage}/{instru}/{b}-{s}", stage, instru, b, s, seq, ",".join(deps.get(stage, [])), "pending")
+            for b, s in date_ranges for seq, stage in enumerate(stages) for instru in universe
+        ]
+        self.init()
+        with closing(self.__connect()) as conn:
+            before = conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO units (unit_id, stage, instrument, bgn_date, stp_date, seq, deps, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("COMMIT")
+            after = conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+        logger.info(f"{SFG(after - before)} new units submitted to {SFY(self.queue_path)}, {len(date_ranges)} ranges")
+        return after - before
+
+    def claim(self, worker: str) -> CWorkUnit | None:
+        now = time.time()
+        with closing(self.__connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # requeue expired leases
+                conn.execute(
+                    "UPDATE units SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                    "worker = NULL, lease_expiry = NULL, error = 'lease expired' "
+                    "WHERE status = 'leased' AND lease_expiry < ?",
+                    (self.max_attempts, now - LEASE_SKEW_MARGIN),
+                )
+                row = conn.execute("""
+                    SELECT u.unit_id, u.stage, u.instrument, u.bgn_date, u.stp_date FROM units u
+                    WHERE u.status = 'pending' AND NOT EXISTS (
+                        SELECT 1 FROM units v
+                        WHERE v.instrument = u.instrument AND v.status != 'done' AND (
+                            (v.stage = u.stage AND (v.status = 'leased' OR v.bgn_date < u.bgn_date))
+                            OR (instr(',' || u.deps || ',', ',' || v.stage || ',') > 0 AND v.bgn_date < u.stp_date)
+                        )
+                    )
+                    ORDER BY u.bgn_date, u.seq, u.instrument
+                    LIMIT 1
+                """).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE units SET status = 'leased', worker = ?, lease_expiry = ?, attempts = attempts + 1 "
+                        "WHERE unit_id = ?",
+                        (worker, now + self.lease_seconds, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return None if row is None else CWorkUnit(*row)
+
+    def renew(self, unit: CWorkUnit, worker: str) -> bool:
+        """
+        return: False if the lease is lost, i.e. it expired and was requeued or claimed by another worker
+
+        """
+        with closing(self.__connect()) as conn:
+            cur = conn.execute(
+                "UPDATE units SET lease_expiry = ? WHERE unit_id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, unit.unit_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, unit: CWorkUnit, worker: str) -> None:
+        with closing(self.__connect()) as conn:
+            conn.execute(
+                "UPDATE units SET status = 'done', lease_expiry = NULL, error = NULL "
+                "WHERE unit_id = ? AND worker = ?",
+                (unit.unit_id, worker),
+            )
+        return None
+
+    def fail(self, unit: CWorkUnit, worker: str, error: str) -> None:
+        with closing(self.__connect()) as conn:
+            conn.execute(
+                "UPDATE units SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                "worker = NULL, lease_expiry = NULL, error = ? WHERE unit_id = ? AND worker = ?",
+                (self.max_attempts, error, unit.unit_id, worker),
+            )
+        return None
+
+    def summary(self) -> dict[str, int]:
+        with closing(self.__connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class CLeaseKeeper:
+    """
+    renew the lease of a unit in a background thread while the worker is running it
+    """
+
+    def __init__(self, queue: CWorkQueue, unit: CWorkUnit, worker: str):
+        self.queue = queue
+        self.unit = unit
+        self.worker = worker
+        self.lost = False
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __renew(self) -> bool:
+        if not self.lost and not self.queue.renew(self.unit, self.worker):
+            self.lost = True
+            logger.error(f"Lease of {SFR(self.unit.unit_id)} is lost by {SFR(self.worker)}")
+        return not self.lost
+
+    def __run(self):
+        while not self.__stop.wait(self.queue.lease_seconds / 3):
+            if not self.__renew():
+                return
+
+    def fence(self) -> None:
+        """
+        renew the lease before a write to an output db, raise if it is lost
+
+        """
+        if not self.__renew():
+            raise RuntimeError(f"lease of {self.unit.unit_id} is lost, write is aborted")
+        return None
+
+    def __enter__(self) -> "CLeaseKeeper":
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.__stop.set()
+        self.__thread.join()
+        return False
+
+
+def run_worker(
+        queue_path: str, lease_seconds: float, handlers: dict[str, TUnitHandler], poll_interval: float = 10,
+) -> list[CTaskStats]:
+    """
+    params: handlers: {stage: handler}, handler is called as
+            handler(instru=unit.instrument, bgn_date=unit.bgn_date, stp_date=unit.stp_date, fence=fence),
+            it should call fence() right before each write to an output db, see CLeaseKeeper.fence
+
+    run units until no unit could be claimed and no unit is leased, units left pending
+    then are blocked by failed units
+
+    """
+    queue = CWorkQueue(queue_path=queue_path, lease_seconds=lease_seconds)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    task_stats: list[CTaskStats] = []
+    while True:
+        unit = queue.claim(worker)
+        if unit is None:
+            summary = queue.summary()
+            if summary.get("leased", 0) == 0:
+                if summary.get("pending", 0) > 0:
+                    logger.warning(f"Pending units are blocked by failed units, queue summary = {summary}")
+                logger.info(f"Worker {SFG(worker)} exits, queue summary = {summary}")
+                break
+            time.sleep(poll_interval)
+            continue
+        try:
+            with CLeaseKeeper(queue, unit, worker) as keeper:
+                stats = handlers[unit.stage](
+                    instru=unit.instrument, bgn_date=unit.bgn_date, stp_date=unit.stp_date, fence=keeper.fence,
+                )
+            if keeper.lost:
+                raise RuntimeError(f"lease of {unit.unit_id} was lost while running")
+        except Exception as e:
+            logger.error(f"Worker {SFR(worker)} failed at {SFR(unit.unit_id)}: {e}")
+            queue.fail(unit, worker, error=traceback.format_exc())
+        else:
+            queue.complete(unit, worker)
+            task_stats.append(stats)
+    return task_stats
+
+
+def main_queue_work(
+        queue_path: str, lease_seconds: float, handlers: dict[str, TUnitHandler],
+        call_multiprocess: bool, processes: int, perf_run: CPerfRun,
+):
+    if call_multiprocess:
+        def __callback(task_stats: list[CTaskStats]):
+            for stats in task_stats:
+                perf_run.add(stats)
+
+        with mp.get_context("spawn").Pool(processes) as pool:
+            for _ in range(processes or os.cpu_count()):
+                pool.apply_async(
+                    run_worker,
+                    args=(queue_path, lease_seconds, handlers),
+                    callback=__callback,
+                    error_callback=error_handler,
+                )
+            pool.close()
+            pool.join()
+    else:
+        for stats in run_worker(queue_path, lease_seconds, handlers):
+            perf_run.add(stats)
+    return 0